@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Vectorized loan maths. Every function accepts scalars or array-likes and
+# broadcasts them with NumPy, so a whole batch of loans is priced in one pass.
+
+def _arrays(*values):
+    return np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in values))
+
+def emi(principal, annual_rate, tenure_months):
+    # Same formula and rounding as views.calculate_emi, for arrays of loans
+    p, rate, n = _arrays(principal, annual_rate, tenure_months)
+    r = (rate / 100) / 12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.power(1 + r, n)
+        amortized = np.round(p * r * growth / (growth - 1), 2)
+        flat = p / n
+    return np.where(n == 0, 0.0, np.where(rate == 0, flat, amortized))
+
+def outstanding_balance(principal, annual_rate, tenure_months, periods_paid, installment=None):
+    """
+    Principal still owed after `periods_paid` instalments, in closed form:
+    B(k) = P(1+r)^k - E((1+r)^k - 1)/r, or P - E*k for interest-free loans.
+    `installment` defaults to emi(); pass the stored EMI to follow a loan's
+    actual repayments.
+    """
+    p, rate, n, k = _arrays(principal, annual_rate, tenure_months, periods_paid)
+    e = emi(p, rate, n) if installment is None else np.broadcast_to(np.asarray(installment, dtype=float), p.shape)
+    k = np.clip(k, 0, n)
+    r = (rate / 100) / 12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.power(1 + r, k)
+        balance = np.where(r == 0, p - e * k, p * growth - e * (growth - 1) / r)
+    # rounding of the EMI leaves a few cents at the end; the last payment settles them
+    return np.where(k >= n, 0.0, np.maximum(balance, 0.0))
+
+def schedule(principal, annual_rate, tenure_months):
+    """
+    Period-by-period amortization for one or more loans. Returns a dict of
+    2-D arrays shaped (loans, longest tenure) - payment, interest, principal
+    and balance after each period - padded with zeros past a loan's tenure.
+    The final payment of each loan is adjusted so its balance ends at zero.
+    """
+    p, rate, n = (np.atleast_1d(a) for a in _arrays(principal, annual_rate, tenure_months))
+    e = emi(p, rate, n)
+    r = ((rate / 100) / 12)[:, None]
+    periods = np.arange(1, int(n.max(initial=0)) + 1)[None, :]
+    active = periods <= n[:, None]
+
+    opening = outstanding_balance(p[:, None], rate[:, None], n[:, None], periods - 1, e[:, None])
+    interest = opening * r
+    last = periods == n[:, None]
+    principal_part = np.where(last, opening, np.minimum(e[:, None] - interest, opening))
+    payment = principal_part + interest
+    balance = opening - principal_part
+
+    return {
+        'payment': np.where(active, payment, 0.0),
+        'interest': np.where(active, interest, 0.0),
+        'principal': np.where(active, principal_part, 0.0),
+        'balance': np.where(active, balance, 0.0),
+    }
+
+def portfolio_outstanding(loans):
+    """
+    Outstanding balance of every loan in `loans` (a Loan queryset) in one
+    query and one vectorized pass. Periods paid are taken as
+    emis_paid_on_time, as repayments_left does. Returns a DataFrame indexed
+    by loan_id.
+    """
+    fields = ['loan_id', 'customer_id', 'loan_amount', 'interest_rate', 'tenure', 'emis_paid_on_time']
+    frame = pd.DataFrame.from_records(list(loans.values_list(*fields)), columns=fields)
+    frame['monthly_installment'] = emi(frame['loan_amount'], frame['interest_rate'], frame['tenure'])
+    frame['outstanding_balance'] = outstanding_balance(
+        frame['loan_amount'], frame['interest_rate'], frame['tenure'],
+        frame['emis_paid_on_time'], frame['monthly_installment'],
+    ).round(2)
+    return frame.set_index('loan_id')
@@ -0,0 +1,89 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.request import Request
+
+from .models import Loan
+from .pagination import LoanCursorPagination
+from .renderers import dumps
+from .serializers import (
+    customer_loan_row,
+    customer_loan_rows,
+    customer_loan_values,
+    view_loan_payload,
+    view_loan_values,
+)
+from .views import CustomerRiskContext, check_loan_eligibility, eligibility_response
+
+# Async versions of the read-heavy endpoints, mounted under /api/async/. They
+# give the same responses as their APIView counterparts in views.py, but wait
+# on the database through the async ORM, so under an ASGI server (uvicorn
+# credit_system.asgi:application) one worker can serve many requests while
+# their queries run. DRF views are sync-only, so these are plain Django views.
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+@csrf_exempt # as DRF's APIView: no session auth, no CSRF check
+@require_POST
+async def check_eligibility(request):
+    """
+    Async /check-eligibility
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return json_response({"error": "Invalid JSON"}, status=400)
+    if not isinstance(data, dict):
+        return json_response({"error": "Expected an object"}, status=400)
+
+    customer_id = data.get('customer_id')
+    context = await CustomerRiskContext.aload(customer_id)
+    if context is None:
+        result = {'approval': False, 'message': 'Customer not found'}
+    else:
+        # With the context loaded the check itself is pure computation
+        result = check_loan_eligibility(
+            customer_id,
+            data.get('loan_amount'),
+            data.get('interest_rate'),
+            data.get('tenure'),
+            context=context
+        )
+    return json_response(eligibility_response(result))
+
+@require_GET
+async def view_loan(request, id):
+    """
+    Async /view-loan/<loan_id>
+    """
+    row = await view_loan_values(Loan.objects.all(), id).afirst()
+    if row is None:
+        return json_response({"detail": "Not found."}, status=404)
+    return json_response(view_loan_payload(row))
+
+@require_GET
+async def view_customer_loans(request, customer_id):
+    """
+    Async /view-loans/<customer_id>: the same cursor pages, or ?stream=1
+    """
+    queryset = Loan.objects.filter(customer__customer_id=customer_id).order_by('id')
+    if request.GET.get('stream') in ('1', 'true'):
+        return StreamingHttpResponse(stream_rows(queryset), content_type='application/json')
+
+    paginator = LoanCursorPagination()
+    page = await paginator.apaginate_queryset(customer_loan_values(queryset), Request(request))
+    return json_response(paginator.get_paginated_data(list(customer_loan_rows(page))))
+
+async def stream_rows(queryset):
+    # Chunked reads, as ViewCustomerLoansView.stream_rows
+    chunk_size = getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+    yield '['
+    i = 0
+    async for row in customer_loan_values(queryset).aiterator(chunk_size=chunk_size):
+        yield (',' if i else '') + dumps(customer_loan_row(row))
+        i += 1
+    yield ']'
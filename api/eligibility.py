@@ -0,0 +1,156 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from . import amortization
+from .models import Customer
+from .policy import DEFAULT_POLICY
+
+# Set-based versions of the eligibility helpers in views.py. The scalar
+# helpers stay the reference; everything here must give the same answers for
+# whole batches of customers at once.
+
+LOAN_AGGREGATE_FIELDS = ['total_emis', 'total_paid_on_time', 'loan_count', 'current_year_loans', 'current_emis_sum']
+CUSTOMER_ID_RANGE = (-2 ** 31, 2 ** 31 - 1)
+SCORE_INPUT_FIELDS = ['customer_id', 'monthly_salary', 'approved_limit', 'current_debt', *LOAN_AGGREGATE_FIELDS]
+
+def current_year_range(field, today=None):
+    # start_date__year=Y as a plain range so it can use the (customer, start_date) index
+    year = (today or datetime.now().date()).year
+    return {f'{field}__gte': date(year, 1, 1), f'{field}__lt': date(year + 1, 1, 1)}
+
+def score_input_annotations(today=None):
+    # Loan aggregates behind the credit score and the EMI check, as annotations
+    # for a Customer queryset (one GROUP BY over the customer's loans)
+    today = today or datetime.now().date()
+    return {
+        'total_emis': Coalesce(Sum('loans__tenure'), 0),
+        'total_paid_on_time': Coalesce(Sum('loans__emis_paid_on_time'), 0),
+        'loan_count': Count('loans'),
+        'current_year_loans': Count('loans', filter=Q(**current_year_range('loans__start_date', today))),
+        'current_emis_sum': Coalesce(
+            Sum('loans__monthly_repayment', filter=Q(loans__end_date__gte=today)), Decimal('0')
+        ),
+    }
+
+def score_inputs_frame(customer_ids):
+    # Score inputs for many customers, indexed by customer_id
+    return customers_score_inputs(Customer.objects.filter(customer_id__in=list(customer_ids)))
+
+def customers_score_inputs(customers):
+    # Score inputs for a Customer queryset, indexed by customer_id: one query
+    # over their CustomerExposure rows, plus one aggregate over Loan for the
+    # customers without a current row
+    today = datetime.now().date()
+    stored = (
+        customers
+        .annotate(**{name: F(f'exposure__{name}') for name in LOAN_AGGREGATE_FIELDS}, as_of=F('exposure__as_of'))
+        .values(*SCORE_INPUT_FIELDS, 'as_of')
+    )
+    rows, stale = [], []
+    for row in stored:
+        if row.pop('as_of') == today:
+            rows.append(row)
+        else:
+            stale.append(row['customer_id'])
+    if stale:
+        # many stale rows (a new day before the nightly rebuild): aggregate the
+        # whole queryset rather than send a huge IN list
+        live = customers.filter(customer_id__in=stale) if len(stale) <= 500 else customers
+        stale = set(stale)
+        rows += [
+            row for row in live.annotate(**score_input_annotations(today)).values(*SCORE_INPUT_FIELDS)
+            if row['customer_id'] in stale
+        ]
+    frame = pd.DataFrame.from_records(list(rows), columns=SCORE_INPUT_FIELDS)
+    for col in ('current_debt', 'current_emis_sum'):
+        frame[col] = frame[col].astype(float)
+    return frame.set_index('customer_id')
+
+def score_array(current_debt, approved_limit, total_emis, total_paid_on_time, loan_count, current_year_loans):
+    # views.score_from_inputs over arrays
+    total_emis = np.asarray(total_emis, dtype=float)
+    total_paid_on_time = np.asarray(total_paid_on_time, dtype=float)
+    ratio = np.divide(total_paid_on_time, total_emis,
+                      out=np.ones_like(total_emis), where=total_emis > 0)
+
+    score = np.full(total_emis.shape, 100)
+    score -= np.select([ratio < 0.8, ratio < 0.9], [30, 15], default=0)
+    score -= np.where(np.asarray(loan_count) > 5, 20, 0)
+    score -= np.where(np.asarray(current_year_loans) > 3, 25, 0)
+    score = np.maximum(score, 0)
+    return np.where(np.asarray(current_debt, dtype=float) > np.asarray(approved_limit, dtype=float), 0, score)
+
+def decide(score, interest_rate, loan_amount, tenure, current_emis_sum, monthly_salary, policy=DEFAULT_POLICY):
+    """
+    The decision of check_loan_eligibility over arrays: returns (score_ok,
+    corrected_rate, installment, emi_ok). An application is approved where
+    score_ok and emi_ok are both true.
+    """
+    score = np.asarray(score)
+    rate = np.asarray(interest_rate, dtype=float)
+
+    # Credit score tiers
+    score_ok = score > policy.min_score
+    medium = (score > policy.medium_score) & (score <= policy.prime_score)
+    low = score_ok & (score <= policy.medium_score)
+    corrected = np.where(medium & (rate <= policy.medium_rate), policy.medium_rate, rate)
+    corrected = np.where(low & (rate <= policy.low_rate), policy.low_rate, corrected)
+
+    # EMI check against max_emi_share of the monthly salary
+    installment = amortization.emi(loan_amount, corrected, tenure)
+    emi_ok = (np.asarray(current_emis_sum, dtype=float) + installment) <= (
+        np.asarray(monthly_salary, dtype=float) * policy.max_emi_share)
+    return score_ok, corrected, installment, emi_ok
+
+def evaluate_applications(applications, policy=DEFAULT_POLICY):
+    """
+    check_loan_eligibility for a list of applications (dicts with customer_id,
+    loan_amount, interest_rate and tenure). Customers are loaded in one query
+    and the score tiers, EMIs and salary check are evaluated with NumPy.
+    Returns one result dict per application, in input order.
+    """
+    apps = pd.DataFrame.from_records(
+        list(applications), columns=['customer_id', 'loan_amount', 'interest_rate', 'tenure'])
+    for col in apps.columns:
+        apps[col] = pd.to_numeric(apps[col], errors='coerce')
+    # customer ids must be whole numbers that fit Customer.customer_id (an IntegerField)
+    ids = apps['customer_id']
+    valid = (apps.notna().all(axis=1) & (ids % 1 == 0) & ids.between(*CUSTOMER_ID_RANGE)).to_numpy()
+
+    inputs = score_inputs_frame(apps.loc[valid, 'customer_id'].astype('int64').unique())
+    known = apps['customer_id'].isin(inputs.index).to_numpy() & valid
+    data = inputs.reindex(apps['customer_id']).reset_index(drop=True)
+
+    score = score_array(data['current_debt'], data['approved_limit'], data['total_emis'],
+                        data['total_paid_on_time'], data['loan_count'], data['current_year_loans'])
+    score_ok, corrected, installment, emi_ok = decide(
+        score, apps['interest_rate'], apps['loan_amount'], apps['tenure'],
+        data['current_emis_sum'], data['monthly_salary'], policy)
+
+    message = np.select(
+        [~valid, ~known, ~score_ok, ~emi_ok],
+        ['Invalid application', 'Customer not found', 'Credit score too low',
+         f'Total EMI exceeds {policy.max_emi_share:.0%} of monthly salary'],
+        default='',
+    )
+    approval = message == ''
+
+    results = []
+    for i, app in enumerate(applications):
+        result = {
+            'customer_id': app.get('customer_id'),
+            'approval': bool(approval[i]),
+            'interest_rate': app.get('interest_rate'),
+            'corrected_interest_rate': float(corrected[i]) if approval[i] else None,
+            'tenure': app.get('tenure'),
+            'monthly_installment': float(installment[i]) if approval[i] else None,
+        }
+        if not approval[i]:
+            result['message'] = str(message[i])
+        results.append(result)
+    return results
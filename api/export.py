@@ -0,0 +1,159 @@
+import csv
+from datetime import date, datetime
+
+from django.conf import settings
+
+from .models import Loan
+
+# Streaming export of the loan book, each loan joined with its customer, as
+# CSV or Parquet. Rows are read chunk by chunk (a server-side cursor on
+# PostgreSQL) and written out as they arrive, so memory stays flat however
+# many loans there are. Plain MVCC reads: no row locks are taken.
+
+EXPORT_COLUMNS = {
+    # output column: Loan lookup
+    'loan_id': 'loan_id',
+    'customer_id': 'customer_id',
+    'first_name': 'customer__first_name',
+    'last_name': 'customer__last_name',
+    'phone_number': 'customer__phone_number',
+    'monthly_salary': 'customer__monthly_salary',
+    'approved_limit': 'customer__approved_limit',
+    'current_debt': 'customer__current_debt',
+    'loan_amount': 'loan_amount',
+    'tenure': 'tenure',
+    'interest_rate': 'interest_rate',
+    'monthly_repayment': 'monthly_repayment',
+    'emis_paid_on_time': 'emis_paid_on_time',
+    'start_date': 'start_date',
+    'end_date': 'end_date',
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def parse_filters(start=None, end=None, active=None):
+    # export_rows filters from their text form (query string or command line).
+    # Raises ValueError with a message for the client.
+    filters = {}
+    for name, value in (('start', start), ('end', end)):
+        if value:
+            try:
+                filters[name] = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+    if active:
+        if active.lower() not in ('1', 'true', '0', 'false'):
+            raise ValueError("active must be true or false")
+        filters['active'] = active.lower() in ('1', 'true')
+    return filters
+
+def export_rows(start=None, end=None, active=None, today=None, chunk_size=None):
+    """
+    Loans as tuples in EXPORT_COLUMNS order, by loan id. start/end bound the
+    approval date (inclusive); active=True keeps loans still running today,
+    active=False the ones that have ended.
+    """
+    today = today or datetime.now().date()
+    queryset = Loan.objects.order_by('id')
+    if start is not None:
+        queryset = queryset.filter(start_date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(start_date__lte=end)
+    if active is not None:
+        queryset = queryset.filter(**{'end_date__gte' if active else 'end_date__lt': today})
+    chunk_size = chunk_size or getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+    return queryset.values_list(*EXPORT_COLUMNS.values()).iterator(chunk_size=chunk_size)
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class _Buffer:
+    # Write target that hands back what was written since the last drain()
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+class _Text:
+    # csv.writer wants a text file
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def write(self, text):
+        return self.buffer.write(text.encode())
+
+def iter_csv(rows, chunk_size=2000):
+    # UTF-8 CSV, header first, as one bytes string per chunk of rows
+    buffer = _Buffer()
+    writer = csv.writer(_Text(buffer))
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.drain()
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.drain()
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('loan_id', pa.int64()),
+        ('customer_id', pa.int64()),
+        ('first_name', pa.string()),
+        ('last_name', pa.string()),
+        ('phone_number', pa.int64()),
+        ('monthly_salary', pa.int64()),
+        ('approved_limit', pa.int64()),
+        ('current_debt', pa.decimal128(12, 2)),
+        ('loan_amount', pa.decimal128(12, 2)),
+        ('tenure', pa.int32()),
+        ('interest_rate', pa.decimal128(5, 2)),
+        ('monthly_repayment', pa.decimal128(10, 2)),
+        ('emis_paid_on_time', pa.int32()),
+        ('start_date', pa.date32()),
+        ('end_date', pa.date32()),
+    ])
+
+def iter_parquet(rows, chunk_size=50000):
+    # A Parquet file, one row group per chunk of rows, yielded as it is written
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    buffer = _Buffer()
+    writer = pq.ParquetWriter(buffer, schema)
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield buffer.drain()
+    finally:
+        writer.close()
+    yield buffer.drain()
+
+def iter_export(file_format, rows):
+    return iter_parquet(rows) if file_format == 'parquet' else iter_csv(rows)
@@ -0,0 +1,145 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import F
+
+from . import routers
+from .eligibility import LOAN_AGGREGATE_FIELDS, current_year_range, score_input_annotations
+from .models import Customer, CustomerExposure
+
+# Upkeep of the CustomerExposure summary table. Loans written through the ORM
+# adjust their customer's row (signals.py), ingestion refreshes the customers
+# of every batch, and reconcile(), run nightly by Celery beat, recomputes all
+# rows from Loan, reports drift and repairs it. A new day makes every row
+# stale (as_of), so readers fall back to the live aggregates until then.
+# Rows are always written from aggregates read on the primary, never from a
+# replica that may not have the loan write yet.
+
+EXPOSURE_FIELDS = LOAN_AGGREGATE_FIELDS
+# the fields that do not change with the date
+STABLE_FIELDS = ['total_emis', 'total_paid_on_time', 'loan_count']
+
+def _today(today):
+    return today or datetime.now().date()
+
+def _as_date(value):
+    # Loan dates may still be datetimes (pandas Timestamps) before a reload
+    return value.date() if isinstance(value, datetime) else value
+
+def is_current(exposure, today=None):
+    return exposure is not None and exposure.as_of == _today(today)
+
+def apply(customer, today=None):
+    # Copy a customer's current exposure row (loaded with
+    # select_related('exposure')) onto it as the score input attributes.
+    # False when there is no current row.
+    exposure = getattr(customer, 'exposure', None)
+    if not is_current(exposure, today):
+        return False
+    for name in EXPOSURE_FIELDS:
+        setattr(customer, name, getattr(exposure, name))
+    return True
+
+def create_empty(customer, today=None):
+    # The row of a customer that has no loans yet
+    return CustomerExposure.objects.create(customer=customer, as_of=_today(today))
+
+def live_exposures(customer_ids, today=None):
+    # Aggregates straight from Loan, {customer_id: {field: value}}
+    rows = (
+        Customer.objects.filter(customer_id__in=list(customer_ids))
+        .annotate(**score_input_annotations(_today(today)))
+        .values('customer_id', *EXPOSURE_FIELDS)
+    )
+    return {row.pop('customer_id'): row for row in rows}
+
+@routers.primary()
+def refresh(customer_ids, today=None, batch_size=1000):
+    # Recompute and upsert the rows of customer_ids, in one aggregate query and
+    # one bulk upsert per batch. Returns the number of rows written.
+    today = _today(today)
+    customer_ids = list(customer_ids)
+    written = 0
+    for start in range(0, len(customer_ids), batch_size):
+        live = live_exposures(customer_ids[start:start + batch_size], today)
+        CustomerExposure.objects.bulk_create(
+            [CustomerExposure(customer_id=customer_id, as_of=today, **values) for customer_id, values in live.items()],
+            update_conflicts=True,
+            unique_fields=['customer'],
+            update_fields=EXPOSURE_FIELDS + ['as_of', 'updated_at'],
+        )
+        written += len(live)
+    return written
+
+@routers.primary()
+def add_loan(loan, today=None):
+    # A new loan: add it to its customer's current row with one UPDATE, or
+    # rebuild the row when there is no current one
+    today = _today(today)
+    active = _as_date(loan.end_date) >= today
+    this_year = current_year_range('start_date', today)
+    current_year = this_year['start_date__gte'] <= _as_date(loan.start_date) < this_year['start_date__lt']
+    updated = CustomerExposure.objects.filter(customer_id=loan.customer_id, as_of=today).update(
+        total_emis=F('total_emis') + loan.tenure,
+        total_paid_on_time=F('total_paid_on_time') + loan.emis_paid_on_time,
+        loan_count=F('loan_count') + 1,
+        current_year_loans=F('current_year_loans') + int(current_year),
+        current_emis_sum=F('current_emis_sum') + (Decimal(str(loan.monthly_repayment)) if active else 0),
+    )
+    if not updated:
+        refresh([loan.customer_id], today)
+
+@routers.primary()
+def recompute(customer_id, today=None):
+    # A changed or deleted loan: recompute the customer's existing row. A
+    # missing row stays missing (readers fall back, reconcile() adds it), so
+    # this never inserts for a customer that is being deleted.
+    today = _today(today)
+    values = live_exposures([customer_id], today).get(customer_id)
+    if values is not None:
+        CustomerExposure.objects.filter(customer_id=customer_id).update(as_of=today, **values)
+
+def reconcile(repair=True, today=None, chunk_size=2000, sample_size=20):
+    """
+    Compare every customer's exposure row with the live aggregates from Loan.
+    Returns a report with the number of rows checked, missing, stale (as_of
+    before today) and drifted (values differ), plus a sample of drifted
+    customer ids. With repair, every row that is not exact is rewritten.
+    """
+    today = _today(today)
+    report = {'checked': 0, 'missing': 0, 'stale': 0, 'drifted': 0, 'repaired': 0, 'drifted_sample': []}
+    customer_ids = Customer.objects.order_by('customer_id').values_list('customer_id', flat=True)
+    chunk = []
+    for customer_id in customer_ids.iterator(chunk_size=chunk_size):
+        chunk.append(customer_id)
+        if len(chunk) == chunk_size:
+            _reconcile_chunk(chunk, today, repair, report, sample_size)
+            chunk = []
+    if chunk:
+        _reconcile_chunk(chunk, today, repair, report, sample_size)
+    return report
+
+def _reconcile_chunk(customer_ids, today, repair, report, sample_size):
+    live = live_exposures(customer_ids, today)
+    stored = {
+        row.pop('customer_id'): row
+        for row in CustomerExposure.objects.filter(customer_id__in=customer_ids).values('customer_id', 'as_of', *EXPOSURE_FIELDS)
+    }
+    wrong = []
+    for customer_id, values in live.items():
+        row = stored.get(customer_id)
+        if row is None:
+            report['missing'] += 1
+        elif any(row[name] != values[name] for name in (EXPOSURE_FIELDS if row['as_of'] == today else STABLE_FIELDS)):
+            # a stale row is only expected to differ in the date dependent fields
+            report['drifted'] += 1
+            if len(report['drifted_sample']) < sample_size:
+                report['drifted_sample'].append(customer_id)
+        elif row['as_of'] != today:
+            report['stale'] += 1
+        else:
+            continue
+        wrong.append(customer_id)
+    report['checked'] += len(live)
+    if repair and wrong:
+        report['repaired'] += refresh(wrong, today)
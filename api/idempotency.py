@@ -0,0 +1,136 @@
+import functools
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+# Idempotency-Key support for the endpoints that create rows (/register/ and
+# /create-loan/), and coalescing of identical in-flight requests for the
+# read-only /check-eligibility/.
+#
+# A client that retries a POST with the same Idempotency-Key header gets the
+# response of the first attempt back (marked Idempotent-Replayed: true)
+# instead of a second customer or loan. Responses live in the cache named by
+# IDEMPOTENCY_CACHE for IDEMPOTENCY_TTL seconds; while the first attempt is
+# still running a retry gets 409, and a key reused for a different request
+# body gets 422. Server errors (5xx) are not stored, so they can be retried.
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+def _cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_TTL', 24 * 60 * 60)
+
+def _lock_timeout():
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+def fingerprint(data):
+    # Hash of a request body, independent of key order
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def _error(message, code):
+    return Response({"error": message}, status=code)
+
+def _replay(stored, request_fingerprint):
+    if stored['fingerprint'] != request_fingerprint:
+        return _error(f"{HEADER} was already used for a different request",
+                      status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(scope):
+    """
+    Decorator for an APIView handler method: honour the Idempotency-Key header.
+    Keys are scoped per endpoint; requests without the header run as before.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return method(view, request, *args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                return _error(f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters", status.HTTP_400_BAD_REQUEST)
+
+            cache = _cache()
+            cache_key = f"idempotency:{scope}:{key}"
+            lock_key = f"{cache_key}:lock"
+            request_fingerprint = fingerprint(request.data)
+
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, request_fingerprint)
+            if not cache.add(lock_key, request_fingerprint, timeout=_lock_timeout()):
+                return _error(f"A request with this {HEADER} is still in progress", status.HTTP_409_CONFLICT)
+            try:
+                # the first attempt may have finished between get() and add()
+                stored = cache.get(cache_key)
+                if stored is not None:
+                    return _replay(stored, request_fingerprint)
+                response = method(view, request, *args, **kwargs)
+                if response.status_code < 500:
+                    cache.set(cache_key, {
+                        'fingerprint': request_fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                    }, timeout=_ttl())
+                return response
+            finally:
+                cache.delete(lock_key)
+        return wrapper
+    return decorator
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Run one computation per key at a time: callers that arrive while the same
+    key is in flight wait for it and share its result (or exception) instead
+    of computing it again. Nothing is kept once the call returns, so this
+    never serves an answer older than the requests waiting for it. Works
+    across the threads of one process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        # func() for key; returns (result, shared) where shared says whether
+        # the result came from another caller's call
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
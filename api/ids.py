@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
+
+from .models import Customer, IdBlock, Loan
+
+# Block-based ID allocation for customer_id and loan_id. Each process reserves
+# a block of IDs at a time, so a new customer or loan costs no max() lookup and
+# parallel requests never race for the same ID. Blocks come from a database
+# sequence on PostgreSQL (created by migration 0003) and from a row in the
+# IdBlock counter table elsewhere. IDs of a block a process never hands out
+# are lost, so allocated IDs are unique and increasing per process but not
+# gapless.
+#
+# A block taken from the IdBlock table inside a caller's transaction would be
+# rolled back with it while this process kept handing it out, so there only
+# one ID is reserved at a time, and it stands or falls with the caller's
+# writes. Sequences are never rolled back, so PostgreSQL always reserves whole
+# blocks.
+
+class IdAllocator:
+    def __init__(self, name, model, field, block_size=None):
+        self.name = name
+        self.model = model
+        self.field = field
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._ids = deque()
+        self._pid = os.getpid()
+
+    @property
+    def sequence_name(self):
+        return f"api_{self.name}_id_seq"
+
+    def next_id(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker must not reuse its parent's block
+                self._ids.clear()
+                self._pid = os.getpid()
+            if not self._ids:
+                using = router.db_for_write(self.model)
+                if connections[using].vendor != 'postgresql' and self._in_caller_transaction(using):
+                    return self._reserve(block_size=1)[0]
+                self._ids.extend(self._reserve())
+            return self._ids.popleft()
+
+    def reset(self):
+        # forget the reserved block; its unused IDs are skipped
+        with self._lock:
+            self._ids.clear()
+
+    @staticmethod
+    def _in_caller_transaction(using):
+        # TestCase's own transactions stand in for autocommit, as for durable atomic blocks
+        return any(not block._from_testcase for block in connections[using].atomic_blocks)
+
+    def _reserve(self, block_size=None):
+        block_size = block_size or self.block_size or getattr(settings, 'ID_BLOCK_SIZE', 50)
+        using = router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            # never hand out an ID below one already in the table (e.g. loaded by ingestion)
+            floor = self.model.objects.using(using).aggregate(top=Max(self.field))['top'] or 0
+            if connections[using].vendor == 'postgresql':
+                return self._reserve_from_sequence(using, floor, block_size)
+            return self._reserve_from_table(using, floor, block_size)
+
+    def _reserve_from_sequence(self, using, floor, block_size):
+        with connections[using].cursor() as cursor:
+            # every reservation takes this lock, so moving the sequence past
+            # the floor cannot race with another process reading from it
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [self.sequence_name])
+            if floor:
+                cursor.execute(
+                    f"SELECT setval('{self.sequence_name}', %s) FROM {self.sequence_name} "
+                    f"WHERE last_value < %s OR (NOT is_called AND last_value <= %s)",
+                    [floor, floor, floor],
+                )
+            cursor.execute(
+                f"SELECT nextval('{self.sequence_name}') FROM generate_series(1, %s)", [block_size]
+            )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def _reserve_from_table(self, using, floor, block_size):
+        IdBlock.objects.using(using).get_or_create(name=self.name)
+        # a single UPDATE takes the row lock, so concurrent reservations queue up here
+        IdBlock.objects.using(using).filter(name=self.name).update(
+            next_value=Greatest(F('next_value'), floor + 1) + block_size
+        )
+        end = IdBlock.objects.using(using).values_list('next_value', flat=True).get(name=self.name)
+        return range(end - block_size, end)
+
+customer_ids = IdAllocator('customer', Customer, 'customer_id')
+loan_ids = IdAllocator('loan', Loan, 'loan_id')
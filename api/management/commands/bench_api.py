@@ -0,0 +1,222 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max
+from django.test import Client
+from django.urls import Resolver404, resolve
+
+from api import exposure
+from api.models import Customer, Loan
+
+DEFAULT_MIX = 'register=1,check-eligibility=4,create-loan=2,view-loan=3,view-loans=3'
+
+class Command(BaseCommand):
+    help = ("Load-test the API: seed synthetic customers and loans, replay a weighted mix of "
+            "requests at a fixed concurrency and report throughput and p50/p95/p99 latency per "
+            "endpoint as JSON. Requests go through the Django test client, or to a running "
+            "server with --url. Run it against a scratch database (e.g. DB_ENGINE=sqlite).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000, help='synthetic customers to seed')
+        parser.add_argument('--loans-per-customer', type=int, default=5)
+        parser.add_argument('--no-seed', action='store_true', help='use the rows already in the database')
+        parser.add_argument('--requests', type=int, default=2000, help='requests to send')
+        parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='weights per endpoint, name=weight,...')
+        parser.add_argument('--replay', help='JSON lines of {"method", "path", "body"} to send instead of the mix')
+        parser.add_argument('--url', help='base URL of a running server, e.g. http://localhost:8000')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+        parser.add_argument('--output', help='also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if not options['no_seed']:
+            self.seed_data(rng, options['customers'], options['loans_per_customer'])
+
+        if options['replay']:
+            plan = self.load_replay(options['replay'], options['requests'])
+        else:
+            plan = self.build_mix(rng, options['mix'], options['requests'])
+        if not plan:
+            raise CommandError("Nothing to send")
+
+        samples, elapsed = self.replay(plan, options['concurrency'], options['url'])
+        report = self.report(samples, elapsed, options)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        self.stdout.write(output)
+
+    # --- data -----------------------------------------------------------
+
+    def seed_data(self, rng, n_customers, loans_per_customer):
+        first_customer = (Customer.objects.aggregate(top=Max('customer_id'))['top'] or 0) + 1
+        first_loan = (Loan.objects.aggregate(top=Max('loan_id'))['top'] or 0) + 1
+        customers = []
+        for i in range(n_customers):
+            salary = rng.randrange(20000, 300000, 1000)
+            customers.append(Customer(
+                customer_id=first_customer + i, first_name='Bench', last_name=str(i),
+                phone_number=9000000000 + i, monthly_salary=salary,
+                approved_limit=round(36 * salary / 100000) * 100000, age=rng.randint(21, 65),
+            ))
+        Customer.objects.bulk_create(customers, batch_size=5000)
+
+        loans = []
+        loan_id = first_loan
+        for customer in customers:
+            for _ in range(loans_per_customer):
+                tenure = rng.choice([6, 12, 24, 36, 60])
+                start = date(rng.randint(2015, date.today().year), rng.randint(1, 12), 1)
+                loans.append(Loan(
+                    customer_id=customer.customer_id, loan_id=loan_id,
+                    loan_amount=rng.randrange(10000, 1000000, 1000), tenure=tenure,
+                    interest_rate=rng.choice([8, 10, 12, 14, 16]),
+                    monthly_repayment=rng.randrange(500, 40000, 10),
+                    emis_paid_on_time=rng.randint(0, tenure),
+                    start_date=start, end_date=date(start.year + tenure // 12 + 1, start.month, 1),
+                ))
+                loan_id += 1
+        Loan.objects.bulk_create(loans, batch_size=5000)
+        exposure.refresh([customer.customer_id for customer in customers])
+        self.stderr.write(f"Seeded {len(customers)} customers and {len(loans)} loans")
+
+    def build_mix(self, rng, mix, n_requests):
+        try:
+            weights = {name: float(weight) for name, weight in (item.split('=') for item in mix.split(','))}
+        except ValueError:
+            raise CommandError(f"Bad --mix: {mix!r}")
+        unknown = set(weights) - {'register', 'check-eligibility', 'create-loan', 'view-loan', 'view-loans'}
+        if unknown:
+            raise CommandError(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+        customer_ids = list(Customer.objects.values_list('customer_id', flat=True))
+        loan_pks = list(Loan.objects.values_list('id', flat=True))
+        if not customer_ids or not loan_pks:
+            raise CommandError("No customers or loans to send requests for; drop --no-seed")
+
+        def application():
+            return {'customer_id': rng.choice(customer_ids), 'loan_amount': rng.randrange(10000, 500000, 1000),
+                    'interest_rate': rng.choice([8, 11, 13, 15, 18]), 'tenure': rng.choice([6, 12, 24, 36])}
+
+        makers = {
+            'register': lambda: ('POST', '/api/register/', {
+                'first_name': 'Load', 'last_name': 'Test', 'age': rng.randint(21, 65),
+                'monthly_income': rng.randrange(20000, 300000, 1000), 'phone_number': rng.randint(7 * 10 ** 9, 10 ** 10 - 1),
+            }),
+            'check-eligibility': lambda: ('POST', '/api/check-eligibility/', application()),
+            'create-loan': lambda: ('POST', '/api/create-loan/', application()),
+            'view-loan': lambda: ('GET', f'/api/view-loan/{rng.choice(loan_pks)}/', None),
+            'view-loans': lambda: ('GET', f'/api/view-loans/{rng.choice(customer_ids)}/', None),
+        }
+        names = list(weights)
+        picks = rng.choices(names, weights=[weights[n] for n in names], k=n_requests)
+        return [makers[name]() for name in picks]
+
+    def load_replay(self, path, limit):
+        plan, skipped = [], 0
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                    plan.append((entry.get('method', 'GET').upper(), entry['path'], entry.get('body')))
+                except (ValueError, KeyError, AttributeError):
+                    skipped += 1
+        if skipped:
+            self.stderr.write(f"Skipped {skipped} lines of {path} that are not {{method, path, body}} requests")
+        return plan[:limit] if limit else plan
+
+    # --- replay ---------------------------------------------------------
+
+    def replay(self, plan, concurrency, base_url):
+        samples = defaultdict(list) # endpoint -> [(seconds, ok)]
+        lock = threading.Lock()
+        cursor = iter(plan)
+
+        def worker():
+            client = None if base_url else Client(raise_request_exception=False, HTTP_HOST='localhost')
+            try:
+                while True:
+                    with lock:
+                        item = next(cursor, None)
+                    if item is None:
+                        return
+                    method, path, body = item
+                    start = time.perf_counter()
+                    ok = self.send(client, base_url, method, path, body)
+                    seconds = time.perf_counter() - start
+                    with lock:
+                        samples[self.endpoint(path)].append((seconds, ok))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - start
+
+    def send(self, client, base_url, method, path, body):
+        if client is not None:
+            if method == 'GET':
+                response = client.get(path)
+            else:
+                response = client.generic(method, path, json.dumps(body), content_type='application/json')
+            return response.status_code < 500
+
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(base_url.rstrip('/') + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return True
+        except urllib.error.HTTPError as exc:
+            return exc.code < 500
+        except OSError:
+            return False
+
+    def endpoint(self, path):
+        try:
+            return resolve(path.split('?')[0]).url_name or path
+        except Resolver404:
+            return path
+
+    def report(self, samples, elapsed, options):
+        def summary(entries):
+            latencies = np.array([seconds for seconds, _ in entries]) * 1000
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            return {
+                'requests': len(entries),
+                'errors': sum(1 for _, ok in entries if not ok),
+                'throughput_rps': round(len(entries) / elapsed, 1),
+                'mean_ms': round(float(latencies.mean()), 3),
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+            }
+
+        everything = [entry for entries in samples.values() for entry in entries]
+        return {
+            'config': {
+                'requests': len(everything),
+                'concurrency': options['concurrency'],
+                'target': options['url'] or 'django test client',
+                'database': connections['default'].vendor,
+            },
+            'elapsed_s': round(elapsed, 3),
+            'total': summary(everything),
+            'endpoints': {name: summary(entries) for name, entries in sorted(samples.items())},
+        }
@@ -0,0 +1,75 @@
+import json
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Customer, Loan
+from api.renderers import ORJSONRenderer
+from api.serializers import (
+    CustomerLoanSerializer,
+    ViewLoanSerializer,
+    customer_loan_rows,
+    customer_loan_values,
+    view_loan_row,
+)
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = ("Benchmark the read paths of /view-loans/ and /view-loan/: ModelSerializer + "
+            "JSONRenderer against the .values() fast path + ORJSONRenderer. Synthetic rows "
+            "are created in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=10000, help='loans for the benchmark customer')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per path; the best one is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                results = self.run(options['loans'], options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, n_loans, repeat):
+        customer_id = (Customer.objects.order_by('-customer_id').values_list('customer_id', flat=True).first() or 0) + 1
+        first_loan_id = (Loan.objects.order_by('-loan_id').values_list('loan_id', flat=True).first() or 0) + 1
+        Customer.objects.create(customer_id=customer_id, first_name='Bench', last_name='Mark',
+                                phone_number=0, monthly_salary=100000, approved_limit=3600000)
+        Loan.objects.bulk_create([
+            Loan(customer_id=customer_id, loan_id=first_loan_id + i, loan_amount=100000, tenure=24,
+                 interest_rate=12, monthly_repayment=4707, emis_paid_on_time=i % 24,
+                 start_date=date(2020, 1, 1), end_date=date(2022, 1, 1))
+            for i in range(n_loans)
+        ], batch_size=5000)
+
+        loans = Loan.objects.filter(customer_id=customer_id).order_by('id')
+        one = Loan.objects.select_related('customer')
+        loan_pk = loans.values_list('id', flat=True).first()
+
+        def best(fn):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            return round(1000 * min(timings), 3)
+
+        list_current = best(lambda: JSONRenderer().render(CustomerLoanSerializer(loans, many=True).data))
+        list_fast = best(lambda: ORJSONRenderer().render(list(customer_loan_rows(customer_loan_values(loans)))))
+        detail_current = best(lambda: JSONRenderer().render(ViewLoanSerializer(one.get(id=loan_pk)).data))
+        detail_fast = best(lambda: ORJSONRenderer().render(view_loan_row(one, loan_pk)))
+
+        return {
+            'loans': n_loans,
+            'view_loans_ms': {'current': list_current, 'fast_path': list_fast,
+                              'speedup': round(list_current / list_fast, 1)},
+            'view_loan_ms': {'current': detail_current, 'fast_path': detail_fast,
+                             'speedup': round(detail_current / detail_fast, 1)},
+        }
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.progress import format_progress
+from api.tasks import load_customers, load_loans
+
+class Command(BaseCommand):
+    help = ("Run the customer and/or loan ingestion in this process, without Celery or Redis, "
+            "printing the same progress the tasks publish (rows read/written/skipped, rows/s, ETA).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['customers', 'loans', 'all'])
+        parser.add_argument('--customers-file', default='data/customer_data.xlsx')
+        parser.add_argument('--loans-file', default='data/loan_data.xlsx')
+        parser.add_argument('--batch-size', type=int, help='rows per batch (default INGESTION_BATCH_SIZE)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='skip unchanged rows and resume from the last checkpoint')
+
+    def handle(self, *args, **options):
+        steps = []
+        if options['kind'] in ('customers', 'all'):
+            steps.append((load_customers, options['customers_file']))
+        if options['kind'] in ('loans', 'all'):
+            steps.append((load_loans, options['loans_file']))
+
+        for load, filename in steps:
+            start = time.perf_counter()
+            result = load(filename, options['batch_size'], options['incremental'], on_progress=self.show)
+            self.stdout.write(f"{result} in {time.perf_counter() - start:.1f}s")
+
+    def show(self, state):
+        self.stderr.write(format_progress(state))
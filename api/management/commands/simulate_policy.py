@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import simulation
+from api.policy import DEFAULT_POLICY, EligibilityPolicy
+
+class Command(BaseCommand):
+    help = ("What-if simulation of a policy change: every customer applies for the same "
+            "hypothetical loan under the current eligibility policy and under the given "
+            "thresholds, and the approval outcomes and their deltas are printed as JSON. "
+            "Same as POST /api/simulate-policy/.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loan-amount', type=float, required=True)
+        parser.add_argument('--interest-rate', type=float, required=True)
+        parser.add_argument('--tenure', type=int, required=True, help='months')
+        for name, kind in EligibilityPolicy.FIELDS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=kind,
+                                help=f"proposed {name} (current: {getattr(DEFAULT_POLICY, name)})")
+        parser.add_argument('--output', help='also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        thresholds = {name: options[name] for name in EligibilityPolicy.FIELDS if options[name] is not None}
+        try:
+            loan = simulation.parse_loan(options['loan_amount'], options['interest_rate'], options['tenure'])
+            policy = EligibilityPolicy.from_dict(thresholds)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = json.dumps(simulation.simulate(policy, **loan), indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        self.stdout.write(output)
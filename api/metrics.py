@@ -0,0 +1,75 @@
+import functools
+import os
+import time
+
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Prometheus metrics. Requests are recorded by QueryBudgetMiddleware (one
+# call per request, with the numbers it measures anyway), hot-path functions
+# and Celery tasks by the timed() decorator. With PROMETHEUS_MULTIPROC_DIR set
+# every process (gunicorn workers, Celery workers on the same host) writes its
+# values there and /metrics adds them up; without it, /metrics shows this
+# process only.
+
+# from calculate_emi (microseconds) up to an ingestion run (an hour)
+FUNCTION_BUCKETS = (
+    .00001, .00005, .0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30, 120, 600, 3600,
+)
+
+REQUESTS = Counter(
+    'api_requests_total', 'HTTP requests by view, method and status', ['view', 'method', 'status'])
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds', 'Time to produce a response, by view', ['view'])
+REQUEST_QUERIES = Histogram(
+    'api_request_db_queries', 'SQL queries per request, by view', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+FUNCTION_DURATION = Histogram(
+    'api_function_duration_seconds', 'Time spent in instrumented functions and tasks', ['function'],
+    buckets=FUNCTION_BUCKETS)
+FUNCTION_ERRORS = Counter(
+    'api_function_errors_total', 'Exceptions raised by instrumented functions and tasks', ['function'])
+SCORE_CACHE = Counter(
+    'api_score_cache_requests_total', 'Credit score cache lookups, by result', ['result'])
+
+def observe_request(view, method, status, duration, queries):
+    REQUESTS.labels(view, method, status).inc()
+    REQUEST_DURATION.labels(view).observe(duration)
+    REQUEST_QUERIES.labels(view).observe(queries)
+
+def timed(name):
+    # Decorator: time every call of the function under function=name
+    def decorator(func):
+        duration = FUNCTION_DURATION.labels(name)
+        errors = FUNCTION_ERRORS.labels(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                duration.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def metrics_view(request):
+    """
+    /metrics in the Prometheus text format
+    """
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
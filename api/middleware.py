@@ -0,0 +1,151 @@
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+# Per-request database and serialization accounting. For every request the
+# middleware records the number of SQL queries, the time spent in them and the
+# time spent rendering the response body, adds them as X-DB-Queries,
+# X-DB-Time-ms, X-Serialization-Time-ms and X-Total-Time-ms headers when
+# DEBUG is on, and folds them into a per-endpoint summary (endpoint_report())
+# and the Prometheus metrics (metrics.py).
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.view_done = None
+        self.render_done = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    @property
+    def serialization_time(self):
+        if self.view_done is None or self.render_done is None:
+            return 0.0
+        return self.render_done - self.view_done
+
+class EndpointReport:
+    # Running totals per endpoint (URL name), shared by the threads of a process
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, stats, total_time):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time': 0.0, 'serialization_time': 0.0, 'total_time': 0.0,
+            })
+            entry['requests'] += 1
+            entry['queries'] += stats.queries
+            entry['max_queries'] = max(entry['max_queries'], stats.queries)
+            entry['db_time'] += stats.db_time
+            entry['serialization_time'] += stats.serialization_time
+            entry['total_time'] += total_time
+
+    def summary(self):
+        # Averages per request, times in milliseconds
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': e['requests'],
+                    'avg_queries': e['queries'] / e['requests'],
+                    'max_queries': e['max_queries'],
+                    'avg_db_ms': 1000 * e['db_time'] / e['requests'],
+                    'avg_serialization_ms': 1000 * e['serialization_time'] / e['requests'],
+                    'avg_total_ms': 1000 * e['total_time'] / e['requests'],
+                }
+                for endpoint, e in self._endpoints.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+report = EndpointReport()
+
+def endpoint_report():
+    return report.summary()
+
+def _add_wrapper(stats):
+    for connection in connections.all():
+        connection.execute_wrappers.append(stats)
+
+def _remove_wrapper(stats):
+    for connection in connections.all():
+        connection.execute_wrappers.remove(stats)
+
+class QueryBudgetMiddleware:
+    # Sync and async capable, so async views (async_views.py) are not pushed
+    # back onto a thread by this middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = request.query_stats = RequestStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = request.query_stats = RequestStats()
+        start = time.perf_counter()
+        # The async ORM runs queries on the request's sync thread, whose
+        # connections are not the ones visible here, so hook them over there
+        await sync_to_async(_add_wrapper)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_wrapper)(stats)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, total_time):
+        match = request.resolver_match
+        if match is not None:
+            report.record(match.view_name, stats, total_time)
+        # unresolved URLs share one label to keep the series count bounded
+        metrics.observe_request(
+            match.view_name if match is not None else 'unmatched',
+            request.method, response.status_code, total_time, stats.queries,
+        )
+
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(stats.queries)
+            response['X-DB-Time-ms'] = f"{1000 * stats.db_time:.2f}"
+            response['X-Serialization-Time-ms'] = f"{1000 * stats.serialization_time:.2f}"
+            response['X-Total-Time-ms'] = f"{1000 * total_time:.2f}"
+        return response
+
+    def process_template_response(self, request, response):
+        # Called after the view, right before a DRF Response is rendered
+        stats = request.query_stats
+        stats.view_done = time.perf_counter()
+
+        def rendered(response):
+            stats.render_done = time.perf_counter()
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+SEQUENCES = ['api_customer_id_seq', 'api_loan_id_seq']
+
+
+def create_sequences(apps, schema_editor):
+    # Only PostgreSQL has sequences; other databases use the IdBlock table
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in SEQUENCES:
+        schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {name}")
+
+
+def drop_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in SEQUENCES:
+        schema_editor.execute(f"DROP SEQUENCE IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_incremental_ingestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdBlock',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(create_sequences, drop_sequences),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_loan_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerExposure',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='exposure', serialize=False, to='api.customer')),
+                ('total_emis', models.IntegerField(default=0)),
+                ('total_paid_on_time', models.IntegerField(default=0)),
+                ('loan_count', models.IntegerField(default=0)),
+                ('current_year_loans', models.IntegerField(default=0)),
+                ('current_emis_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('as_of', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_customer_exposure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerScore',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stored_score', serialize=False, to='api.customer')),
+                ('credit_score', models.IntegerField()),
+                ('computed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
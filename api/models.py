@@ -14,6 +14,9 @@ class Customer(models.Model):
     # New fields from /register endpoint 
     age = models.IntegerField(null=True, blank=True) # null=True because old data doesn't have it
 
+    # Content hash of the source row, used by incremental ingestion
+    row_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -29,5 +32,64 @@ class Loan(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
 
+    # Content hash of the source row, used by incremental ingestion
+    row_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of /view-loans/ walks a customer's loans by id
+            models.Index(fields=['customer', 'id'], name='loan_customer_id_idx'),
+            # active EMI sum: customer = ? AND end_date >= today, answered from
+            # the index alone on PostgreSQL thanks to the included column
+            models.Index(fields=['customer', 'end_date'], include=['monthly_repayment'],
+                         name='loan_customer_end_date_idx'),
+            # current-year loan count: customer = ? AND start_date in [Jan 1, Jan 1 next year)
+            models.Index(fields=['customer', 'start_date'], name='loan_customer_start_date_idx'),
+        ]
+
     def __str__(self):
         return f"Loan {self.loan_id} for {self.customer.first_name}"
+
+class IngestionCheckpoint(models.Model):
+    # Last committed row offset of an ingestion file, so a restarted task can resume
+    key = models.CharField(max_length=255, unique=True) # task name + resolved file path
+    file_signature = models.CharField(max_length=64) # size and mtime, a changed file starts over
+    rows_committed = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} @ {self.rows_committed}"
+
+class IdBlock(models.Model):
+    # Counter table behind api.ids.IdAllocator on databases without sequences
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} @ {self.next_value}"
+
+class CustomerExposure(models.Model):
+    # Loan aggregates of a customer, kept current by api/exposure.py so the
+    # credit score and EMI check read one row instead of aggregating Loan.
+    # current_year_loans and current_emis_sum depend on the date: they are
+    # only valid while as_of is today, older rows are read from Loan instead.
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='exposure')
+    total_emis = models.IntegerField(default=0)
+    total_paid_on_time = models.IntegerField(default=0)
+    loan_count = models.IntegerField(default=0)
+    current_year_loans = models.IntegerField(default=0)
+    current_emis_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    as_of = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Exposure of customer {self.customer_id} as of {self.as_of}"
+
+class CustomerScore(models.Model):
+    # Credit score of a customer as computed by the portfolio rescoring job (api/rescoring.py)
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='stored_score')
+    credit_score = models.IntegerField()
+    computed_at = models.DateTimeField(db_index=True) # start of the rescoring run
+
+    def __str__(self):
+        return f"Customer {self.customer_id}: {self.credit_score} at {self.computed_at}"
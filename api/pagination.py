@@ -0,0 +1,55 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+class LoanCursorPagination(CursorPagination):
+    """
+    Keyset pagination for a customer's loans: pages are fetched with
+    WHERE id > <cursor> ORDER BY id LIMIT n on the (customer, id) index, so
+    the cost of a page does not grow with the number of loans or the page
+    number. ?page_size= overrides the default size.
+    """
+    ordering = 'id'
+    page_size = getattr(settings, 'LOANS_PAGE_SIZE', 100)
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # paginate_queryset for async views: the same cursors and links, with
+        # the page fetched through the async ORM. request is a DRF Request.
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        # ordering is the unique 'id', so a position alone marks the page
+        queryset = queryset.order_by('-id' if reverse else 'id')
+        if current_position is not None:
+            queryset = queryset.filter(**{'id__lt' if reverse else 'id__gt': current_position})
+
+        results = [row async for row in queryset[offset:offset + self.page_size + 1]]
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        following_position = self._get_position_from_instance(results[-1], self.ordering) if has_following else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+        return self.page
+
+    def get_paginated_data(self, data):
+        # get_paginated_response's body, for views that render it themselves
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
@@ -0,0 +1,69 @@
+import math
+
+# The lending policy applied on top of the credit score: which scores are
+# approved, the minimum interest rate for the riskier tiers and how much of
+# the salary all EMIs together may take. check_loan_eligibility and the batch
+# check read DEFAULT_POLICY; the what-if simulator (simulation.py) compares it
+# with alternatives.
+#
+#   score > prime_score                   approved at the requested rate
+#   medium_score < score <= prime_score   approved at >= medium_rate
+#   min_score < score <= medium_score     approved at >= low_rate
+#   score <= min_score                    rejected
+#
+# and in every tier the running EMIs plus the new one must stay within
+# max_emi_share of the monthly salary.
+
+class EligibilityPolicy:
+    FIELDS = {
+        # name: type
+        'prime_score': int,
+        'medium_score': int,
+        'min_score': int,
+        'medium_rate': float,
+        'low_rate': float,
+        'max_emi_share': float,
+    }
+
+    def __init__(self, prime_score=50, medium_score=30, min_score=10,
+                 medium_rate=12.0, low_rate=16.0, max_emi_share=0.5):
+        self.prime_score = prime_score
+        self.medium_score = medium_score
+        self.min_score = min_score
+        self.medium_rate = medium_rate
+        self.low_rate = low_rate
+        self.max_emi_share = max_emi_share
+        if not min_score <= medium_score <= prime_score:
+            raise ValueError("Score thresholds must satisfy min_score <= medium_score <= prime_score")
+        if medium_rate < 0 or low_rate < 0:
+            raise ValueError("Rates must not be negative")
+        if not 0 < max_emi_share <= 1:
+            raise ValueError("max_emi_share must be above 0 and at most 1")
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        # The policy with data's thresholds and base's (default: the current
+        # policy's) for the rest. Raises ValueError with a message for the
+        # client.
+        if not isinstance(data, dict):
+            raise ValueError("A policy is an object of thresholds")
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown policy fields: {', '.join(sorted(unknown))}")
+        values = (base or DEFAULT_POLICY).as_dict()
+        for name, value in data.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"{name} must be a number")
+            values[name] = cls.FIELDS[name](value)
+        return cls(**values)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __eq__(self, other):
+        return isinstance(other, EligibilityPolicy) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f"EligibilityPolicy({', '.join(f'{k}={v!r}' for k, v in self.as_dict().items())})"
+
+DEFAULT_POLICY = EligibilityPolicy()
@@ -0,0 +1,48 @@
+import time
+
+# Progress of an ingestion run, reported after every committed batch: to
+# Celery task state by the ingestion tasks (read back by /ingestion-status/),
+# and to the terminal by `manage.py ingest`.
+
+class IngestionProgress:
+    def __init__(self, name, rows_total=None, on_progress=None):
+        self.name = name
+        self.rows_total = rows_total
+        self.on_progress = on_progress
+        self.start = time.perf_counter()
+        self.start_offset = 0
+
+    def report(self, rows_read, totals):
+        # rows_read: rows of the file behind us, including any skipped on resume
+        elapsed = time.perf_counter() - self.start
+        rate = (rows_read - self.start_offset) / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.rows_total is not None and rate > 0:
+            eta = max(self.rows_total - rows_read, 0) / rate
+        state = {
+            'stage': self.name,
+            'rows_total': self.rows_total,
+            'rows_read': rows_read,
+            'rows_written': totals['created'] + totals['updated'],
+            'rows_unchanged': totals['unchanged'],
+            'rows_skipped': totals['skipped'],
+            'rows_per_second': round(rate, 1),
+            'elapsed_seconds': round(elapsed, 1),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+        }
+        if self.on_progress is not None:
+            self.on_progress(state)
+        return state
+
+    def resumed_at(self, offset):
+        # rows skipped because an earlier run committed them do not count towards the rate
+        self.start_offset = offset
+
+def format_progress(state):
+    total = f"/{state['rows_total']}" if state['rows_total'] is not None else ''
+    percent = (f" ({100 * state['rows_read'] / state['rows_total']:.1f}%)"
+               if state['rows_total'] else '')
+    eta = f", ETA {state['eta_seconds']:.0f}s" if state['eta_seconds'] is not None else ''
+    return (f"{state['stage']}: {state['rows_read']}{total} rows read{percent}, "
+            f"{state['rows_written']} written, {state['rows_unchanged']} unchanged, "
+            f"{state['rows_skipped']} skipped, {state['rows_per_second']:.0f} rows/s{eta}")
@@ -0,0 +1,93 @@
+from pathlib import Path
+import pandas as pd
+
+# Streaming readers for the ingestion files. Every reader yields DataFrames of
+# at most `batch_size` rows, indexed by their row offset in the file, so the
+# memory used by a task depends on the batch size and not on the file size.
+
+def iter_batches(path, batch_size):
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix in ('.xlsx', '.xlsm'):
+        batches = _iter_xlsx(path, batch_size)
+    elif suffix == '.csv':
+        batches = _iter_csv(path, batch_size)
+    elif suffix in ('.parquet', '.pq'):
+        batches = _iter_parquet(path, batch_size)
+    else:
+        # old formats (.xls etc.) cannot be streamed, read them in one go
+        batches = _iter_frame(pd.read_excel(path), batch_size)
+
+    offset = 0
+    for batch in batches:
+        if batch.empty:
+            continue
+        batch.index = pd.RangeIndex(offset, offset + len(batch))
+        offset += len(batch)
+        yield batch
+
+def count_rows(path):
+    # Data rows in the file (header excluded) from cheap metadata, for
+    # progress reporting. An estimate for CSV, None when it cannot be told.
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row # from the sheet's dimension record
+        finally:
+            workbook.close()
+        return max(max_row - 1, 0) if max_row else None
+    if suffix == '.csv':
+        with open(path, 'rb') as fh:
+            lines = sum(chunk.count(b'\n') for chunk in iter(lambda: fh.read(1 << 20), b''))
+        return max(lines - 1, 0)
+    if suffix in ('.parquet', '.pq'):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+def _iter_xlsx(path, batch_size):
+    from openpyxl import load_workbook
+
+    # read_only mode parses the sheet lazily instead of building every cell
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f'column_{i}' for i, c in enumerate(header)]
+        batch = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            batch.append(row[:len(columns)])
+            if len(batch) >= batch_size:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        workbook.close()
+
+def _iter_csv(path, batch_size):
+    with pd.read_csv(path, chunksize=batch_size) as reader:
+        yield from reader
+
+def _iter_parquet(path, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError("pyarrow is required to ingest parquet files") from exc
+
+    parquet_file = pq.ParquetFile(path)
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield record_batch.to_pandas()
+
+def _iter_frame(df, batch_size):
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start:start + batch_size]
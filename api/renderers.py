@@ -0,0 +1,64 @@
+import math
+from decimal import Decimal
+
+import orjson
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+# Aware datetimes in UTC end in 'Z' rather than '+00:00', as DRF writes them
+OPTIONS = orjson.OPT_UTC_Z
+
+def _default(obj):
+    # Types orjson does not know. Decimals are written as strings, the same
+    # way DRF's DecimalField (COERCE_DECIMAL_TO_STRING) writes them.
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if hasattr(obj, 'tolist'):
+        # numpy scalars and arrays
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def _check_finite(obj):
+    # DRF's strict encoder refuses NaN and infinities; orjson writes them as
+    # null, which would silently turn a broken number into a missing one.
+    if isinstance(obj, float):
+        if not math.isfinite(obj):
+            raise ValueError("Out of range float values are not JSON compliant")
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _check_finite(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _check_finite(value)
+    elif hasattr(obj, 'tolist'):
+        _check_finite(obj.tolist())
+
+def _encode(data):
+    encoded = orjson.dumps(data, default=_default, option=OPTIONS)
+    # NaN and infinities can only be behind a null, so the check is skipped
+    # for the (common) output that has none
+    if b'null' in encoded:
+        _check_finite(data)
+    return encoded
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement for rest_framework.renderers.JSONRenderer backed by
+    orjson. Output is compact UTF-8 JSON, like DRF's default settings, and
+    out of range floats raise ValueError as with STRICT_JSON.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return _encode(data)
+
+def dumps(data):
+    # orjson encoding with the renderer's fallbacks and checks, as a str
+    return _encode(data).decode()
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.db.models import Max, Min
+
+from .eligibility import customers_score_inputs, score_array
+from .models import Customer, CustomerScore
+
+# Scoring of the whole book. The customer_id range is cut into shards that
+# Celery workers score independently (tasks.rescore_portfolio): one set-based
+# read of a shard's score inputs, calculate_credit_score's rules applied with
+# NumPy (eligibility.score_array), and one bulk upsert into CustomerScore.
+
+def shard_bounds(shard_size=None):
+    # Half-open [low, high) customer_id ranges of at most shard_size ids each
+    shard_size = shard_size or getattr(settings, 'RESCORE_SHARD_SIZE', 50000)
+    bounds = Customer.objects.aggregate(low=Min('customer_id'), high=Max('customer_id'))
+    if bounds['low'] is None:
+        return []
+    return [
+        (low, min(low + shard_size, bounds['high'] + 1))
+        for low in range(bounds['low'], bounds['high'] + 1, shard_size)
+    ]
+
+def score_shard(low, high, computed_at, batch_size=5000):
+    # Score the customers with low <= customer_id < high and store the
+    # results stamped with computed_at. Returns the number of customers scored.
+    inputs = customers_score_inputs(Customer.objects.filter(customer_id__gte=low, customer_id__lt=high))
+    if inputs.empty:
+        return 0
+    scores = score_array(inputs['current_debt'], inputs['approved_limit'], inputs['total_emis'],
+                         inputs['total_paid_on_time'], inputs['loan_count'], inputs['current_year_loans'])
+    CustomerScore.objects.bulk_create(
+        [
+            CustomerScore(customer_id=customer_id, credit_score=score, computed_at=computed_at)
+            for customer_id, score in zip(inputs.index.tolist(), scores.tolist())
+        ],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=['credit_score', 'computed_at'],
+    )
+    return len(inputs)
@@ -0,0 +1,88 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Read/write splitting. Reads go to a random alias of DATABASE_REPLICAS,
+# writes to the primary. Once a request (or a `with primary():` block) has
+# written anything, its later reads stay on the primary as well, so it always
+# reads its own writes: select_for_update, the re-check under the customer
+# lock and the CustomerExposure upkeep in CreateLoanView, for example.
+# Ingestion and the exposure reconcile run entirely inside primary(), and so
+# does the CustomerExposure upkeep of exposure.py, which reads the aggregates it
+# writes back: outside a request (the shell, management commands, Celery tasks)
+# nothing else pins those reads.
+
+_state = ContextVar('db_routing', default=None)
+
+class _Routing:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+
+def pinned():
+    state = _state.get()
+    return state is not None and state.pinned
+
+def reads_primary():
+    # Whether reads made here go to the primary, and so see the latest writes
+    return not getattr(settings, 'DATABASE_REPLICAS', []) or pinned()
+
+@contextmanager
+def primary():
+    # Send every query in the block to the primary
+    token = _state.set(_Routing(pinned=True))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or pinned():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+class PrimaryPinMiddleware:
+    # Gives every request its own routing state, so a write pins only the
+    # request that made it
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _state.set(_Routing())
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+
+    async def __acall__(self, request):
+        token = _state.set(_Routing())
+        try:
+            return await self.get_response(request)
+        finally:
+            _state.reset(token)
@@ -0,0 +1,105 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics, routers
+from .models import Customer
+
+# Cache of credit score inputs, keyed by customer. An entry is the customer
+# row plus the loan aggregates from views.credit_score_inputs, so a hit
+# rebuilds the whole CustomerRiskContext without touching the database.
+# Entries expire after the cache's TIMEOUT and are dropped by the signal
+# handlers in api/signals.py whenever a customer or one of its loans changes.
+#
+# Dropping an entry leaves a WRITTEN marker for DATABASE_REPLICA_MAX_LAG
+# seconds. A reader on the primary (routers.reads_primary()) replaces it, but
+# one that may have read a replica only fills empty keys, so a replica that
+# has not caught up with the write yet cannot put the old inputs back into the
+# cache for a whole TTL.
+
+AGGREGATE_FIELDS = ['total_emis', 'total_paid_on_time', 'loan_count', 'current_year_loans', 'current_emis_sum']
+
+WRITTEN = 'written'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+def _cache():
+    return caches[getattr(settings, 'CREDIT_SCORE_CACHE', 'default')]
+
+def _replica_lag():
+    return getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 10)
+
+def _key(customer_id):
+    return f"credit-score:{customer_id}"
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+    metrics.SCORE_CACHE.labels(name).inc()
+
+def _decode(entry):
+    if entry is None or entry == WRITTEN:
+        _count('misses')
+        return None
+    _count('hits')
+    fields, aggregates = entry
+    customer = Customer.from_db('default', list(fields), list(fields.values()))
+    for name, value in aggregates.items():
+        setattr(customer, name, value)
+    return customer
+
+def _encode(customer):
+    fields = {f.attname: getattr(customer, f.attname) for f in Customer._meta.concrete_fields}
+    aggregates = {name: getattr(customer, name) for name in AGGREGATE_FIELDS}
+    return fields, aggregates
+
+def get(customer_id):
+    # The cached, annotated Customer for customer_id, or None on a miss
+    return _decode(_cache().get(_key(customer_id)))
+
+def store(customer):
+    if routers.reads_primary():
+        _cache().set(_key(customer.customer_id), _encode(customer))
+    else:
+        _cache().add(_key(customer.customer_id), _encode(customer))
+
+async def aget(customer_id):
+    return _decode(await _cache().aget(_key(customer_id)))
+
+async def astore(customer):
+    if routers.reads_primary():
+        await _cache().aset(_key(customer.customer_id), _encode(customer))
+    else:
+        await _cache().aadd(_key(customer.customer_id), _encode(customer))
+
+def invalidate(customer_id):
+    _cache().set(_key(customer_id), WRITTEN, timeout=_replica_lag())
+
+def invalidate_on_commit(customer_id):
+    # Drop the entry now and again once the current transaction commits, so a
+    # reader that refilled it from pre-commit data in between is not kept
+    invalidate(customer_id)
+    transaction.on_commit(lambda: invalidate(customer_id))
+
+def invalidate_many(customer_ids):
+    # For bulk writes (ingestion) that bypass the model signals
+    _cache().set_many({_key(customer_id): WRITTEN for customer_id in customer_ids}, timeout=_replica_lag())
+
+def invalidate_many_on_commit(customer_ids):
+    # invalidate_many now and once the current transaction commits (see
+    # invalidate_on_commit), for bulk writes inside a transaction
+    customer_ids = list(customer_ids)
+    invalidate_many(customer_ids)
+    transaction.on_commit(lambda: invalidate_many(customer_ids))
+
+def stats():
+    # Hit/miss counters of this process
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
@@ -1,3 +1,4 @@
+from django.db.models import F
 from rest_framework import serializers
 from .models import Customer, Loan
 
@@ -28,4 +29,56 @@ class CustomerLoanSerializer(serializers.ModelSerializer):
 
     def get_repayments_left(self, obj):
         # Calculates remaining EMIs [cite: 87]
-        return obj.tenure - obj.emis_paid_on_time
\ No newline at end of file
+        return obj.tenure - obj.emis_paid_on_time
+
+# Fast-path read serializers. They produce the same dicts as the
+# ModelSerializers above, but straight from .values() querysets: no model
+# instances, no field objects, and repayments_left computed by the database.
+# Decimals are left as Decimal for the renderer (renderers.py) to write out.
+
+CUSTOMER_FIELDS = ['customer_id', 'first_name', 'last_name', 'phone_number', 'age']
+
+def customer_loan_values(queryset):
+    # Loan queryset -> .values() queryset with the /view-loans/ columns
+    return queryset.annotate(
+        monthly_installment=F('monthly_repayment'),
+        repayments_left=F('tenure') - F('emis_paid_on_time'),
+    ).values('id', 'loan_amount', 'interest_rate', 'monthly_installment', 'repayments_left')
+
+def customer_loan_rows(rows):
+    # .values() rows from customer_loan_values -> CustomerLoanSerializer output (lazily)
+    for row in rows:
+        yield customer_loan_row(row)
+
+def customer_loan_row(row):
+    return {
+        'loan_id': row['id'],
+        'loan_amount': row['loan_amount'],
+        'interest_rate': row['interest_rate'],
+        'monthly_installment': row['monthly_installment'],
+        'repayments_left': row['repayments_left'],
+    }
+
+def view_loan_values(queryset, pk):
+    # Loan queryset -> .values() queryset with the /view-loan/ columns of one loan
+    return queryset.filter(id=pk).values(
+        'id', 'loan_amount', 'interest_rate', 'monthly_repayment', 'tenure',
+        *(f'customer__{field}' for field in CUSTOMER_FIELDS),
+    )
+
+def view_loan_row(queryset, pk):
+    # ViewLoanSerializer output for one loan, customer included, in one query
+    return view_loan_payload(view_loan_values(queryset, pk).first())
+
+def view_loan_payload(row):
+    # A view_loan_values row -> ViewLoanSerializer output (None stays None)
+    if row is None:
+        return None
+    return {
+        'loan_id': row['id'],
+        'customer': {field: row[f'customer__{field}'] for field in CUSTOMER_FIELDS},
+        'loan_amount': row['loan_amount'],
+        'interest_rate': row['interest_rate'],
+        'monthly_installment': row['monthly_repayment'],
+        'tenure': row['tenure'],
+    }
@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import exposure, score_cache
+from .models import Customer, Loan
+
+# A loan saved with a different customer_id moves from one customer to
+# another, and both customers' scores and exposure rows change. The customer
+# it belonged to is read before the save and kept on the instance.
+
+@receiver(pre_save, sender=Loan)
+def remember_loan_customer(sender, instance, using, update_fields=None, **kwargs):
+    instance._previous_customer_id = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'customer', 'customer_id'} & set(update_fields):
+        return
+    instance._previous_customer_id = (
+        Loan.objects.using(using).filter(pk=instance.pk).values_list('customer_id', flat=True).first()
+    )
+
+def _loan_customer_ids(loan):
+    # The loan's customer, and the one it just moved from if any
+    previous = getattr(loan, '_previous_customer_id', None)
+    if previous is None or previous == loan.customer_id:
+        return [loan.customer_id]
+    return [loan.customer_id, previous]
+
+# Drop the cached credit score inputs of a customer whenever the customer or
+# one of its loans is written through the ORM.
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_customer_score(sender, instance, **kwargs):
+    score_cache.invalidate_on_commit(instance.customer_id)
+
+@receiver([post_save, post_delete], sender=Loan)
+def invalidate_loan_customer_score(sender, instance, **kwargs):
+    for customer_id in _loan_customer_ids(instance):
+        score_cache.invalidate_on_commit(customer_id)
+
+# Keep the CustomerExposure summary row of the customer in step (exposure.py)
+
+@receiver(post_save, sender=Customer)
+def create_customer_exposure(sender, instance, created, **kwargs):
+    if created:
+        exposure.create_empty(instance)
+
+@receiver(post_save, sender=Loan)
+def update_loan_exposure(sender, instance, created, **kwargs):
+    if created:
+        exposure.add_loan(instance)
+    else:
+        for customer_id in _loan_customer_ids(instance):
+            exposure.recompute(customer_id)
+
+@receiver(post_delete, sender=Loan)
+def remove_loan_exposure(sender, instance, **kwargs):
+    exposure.recompute(instance.customer_id)
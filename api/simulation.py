@@ -0,0 +1,102 @@
+import math
+import time
+
+import numpy as np
+from django.utils import timezone
+
+from .eligibility import customers_score_inputs, decide, score_array
+from .models import Customer
+from .policy import DEFAULT_POLICY
+
+# What-if simulation of a policy change over the whole portfolio: every
+# customer applies for the same hypothetical loan, once under the current
+# policy and once under the proposed one, and the outcomes are compared.
+# Customers' aggregates are read once into a snapshot (their CustomerExposure
+# rows, live aggregates for stale ones) and each policy is one vectorized pass
+# over it, so a simulation takes seconds where replaying requests would take
+# hours. Nothing is written.
+
+class PortfolioSnapshot:
+    """
+    Score inputs and credit scores of every customer at one point in time.
+    Credit scores do not depend on the policy, so they are computed once.
+    """
+    def __init__(self, frame, taken_at=None):
+        self.frame = frame
+        self.taken_at = taken_at or timezone.now()
+        self.score = score_array(frame['current_debt'], frame['approved_limit'], frame['total_emis'],
+                                 frame['total_paid_on_time'], frame['loan_count'], frame['current_year_loans'])
+
+    @classmethod
+    def take(cls, customers=None):
+        # customers: a Customer queryset, default all of them
+        return cls(customers_score_inputs(customers if customers is not None else Customer.objects.all()))
+
+    def __len__(self):
+        return len(self.frame)
+
+def _outcome(snapshot, policy, loan_amount, interest_rate, tenure):
+    score_ok, corrected, _, emi_ok = decide(
+        snapshot.score, np.full(len(snapshot), float(interest_rate)), loan_amount, tenure,
+        snapshot.frame['current_emis_sum'], snapshot.frame['monthly_salary'], policy)
+    return score_ok & emi_ok, score_ok, corrected
+
+def _summary(policy, approved, score_ok, corrected, interest_rate):
+    customers = len(approved)
+    n_approved = int(approved.sum())
+    return {
+        'policy': policy.as_dict(),
+        'approved': n_approved,
+        'approval_rate': round(n_approved / customers, 6) if customers else None,
+        'rejected_credit_score': int((~score_ok).sum()),
+        'rejected_emi': int((score_ok & ~approved).sum()),
+        'rate_corrected': int((approved & (corrected != float(interest_rate))).sum()),
+        'mean_approved_rate': round(float(corrected[approved].mean()), 4) if n_approved else None,
+    }
+
+def simulate(policy, loan_amount, interest_rate, tenure, baseline=None, snapshot=None):
+    """
+    Outcomes of every customer applying for loan_amount at interest_rate over
+    tenure months, under baseline (default: the current policy) and policy.
+    Returns both summaries, their difference and how many customers flip
+    either way. snapshot: a PortfolioSnapshot to reuse, taken if not given.
+    """
+    started = time.perf_counter()
+    baseline = baseline or DEFAULT_POLICY
+    snapshot = snapshot if snapshot is not None else PortfolioSnapshot.take()
+
+    before_approved, before_score_ok, before_rate = _outcome(snapshot, baseline, loan_amount, interest_rate, tenure)
+    after_approved, after_score_ok, after_rate = _outcome(snapshot, policy, loan_amount, interest_rate, tenure)
+    before = _summary(baseline, before_approved, before_score_ok, before_rate, interest_rate)
+    after = _summary(policy, after_approved, after_score_ok, after_rate, interest_rate)
+
+    def change(name):
+        if before[name] is None or after[name] is None:
+            return None
+        return round(after[name] - before[name], 6)
+
+    return {
+        'customers': len(snapshot),
+        'snapshot_taken_at': snapshot.taken_at.isoformat(),
+        'loan': {'loan_amount': loan_amount, 'interest_rate': interest_rate, 'tenure': tenure},
+        'baseline': before,
+        'proposed': after,
+        'delta': {name: change(name) for name in (
+            'approved', 'approval_rate', 'rejected_credit_score', 'rejected_emi', 'rate_corrected', 'mean_approved_rate')},
+        'newly_approved': int((after_approved & ~before_approved).sum()),
+        'newly_rejected': int((before_approved & ~after_approved).sum()),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+def parse_loan(loan_amount, interest_rate, tenure):
+    # The hypothetical loan from request or command line values. Raises
+    # ValueError with a message for the client.
+    try:
+        loan = {'loan_amount': float(loan_amount), 'interest_rate': float(interest_rate), 'tenure': int(tenure)}
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("loan_amount, interest_rate and tenure must be numbers")
+    if not all(math.isfinite(value) for value in loan.values()):
+        raise ValueError("loan_amount, interest_rate and tenure must be numbers")
+    if loan['loan_amount'] <= 0 or loan['tenure'] <= 0 or loan['interest_rate'] < 0:
+        raise ValueError("loan_amount and tenure must be positive and interest_rate not negative")
+    return loan
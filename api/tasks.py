@@ -60,16 +60,46 @@
 
 
 
-from celery import shared_task
+from celery import chord, shared_task
 from celery.utils.log import get_task_logger
+from collections import Counter
 import pandas as pd
-from .models import Customer, Loan
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Customer, Loan, IngestionCheckpoint
+from .progress import IngestionProgress, format_progress
+from .readers import count_rows, iter_batches
+from . import exposure, metrics, rescoring, routers, score_cache
 from datetime import datetime
 from pathlib import Path
 import os
 
 logger = get_task_logger(__name__)
 
+# Possible header names for each model field, resolved once per file
+CUSTOMER_COLUMNS = {
+    'customer_id': ['Customer ID', 'Customer', 'customer_id', 'customer id'],
+    'first_name': ['First Name', 'first_name', 'Firstname', 'first name'],
+    'last_name': ['Last Name', 'last_name', 'Lastname', 'last name'],
+    'age': ['Age', 'age'],
+    'phone_number': ['Phone Number', 'Phone', 'phone_number', 'phone'],
+    'monthly_salary': ['Monthly Salary', 'MonthlySalary', 'monthly_salary', 'salary'],
+    'approved_limit': ['Approved Limit', 'approved_limit', 'ApprovedLimit'],
+}
+
+LOAN_COLUMNS = {
+    'customer_id': ['Customer ID', 'Customer', 'customer_id', 'customer id'],
+    'loan_id': ['Loan ID', 'LoanId', 'loan_id', 'Loan Id', 'loan id'],
+    'loan_amount': ['Loan Amount', 'Amount', 'loan_amount', 'loan amount'],
+    'tenure': ['Tenure', 'tenure'],
+    'interest_rate': ['Interest Rate', 'Interest', 'interest_rate'],
+    'monthly_repayment': ['Monthly Payment', 'MonthlyPayment', 'monthly_repayment', 'monthly payment'],
+    'emis_paid_on_time': ['EMIs paid on time', 'EMIs Paid On Time', 'emis_paid_on_time', 'emis paid on time'],
+    'start_date': ['Date of Approval', 'Start Date', 'start_date', 'date'],
+    'end_date': ['End Date', 'end_date'],
+}
+
 def _project_file_path(filename):
     # try cwd, then project root (two parents up from this file), then absolute path
     candidates = [
@@ -80,7 +110,7 @@ def _project_file_path(filename):
     for p in candidates:
         if p.exists():
             return p
-    # fallback to original name (will raise by pandas if missing)
+    # fallback to original name (the reader will raise if missing)
     return Path(filename)
 
 def _normalize(s: str) -> str:
@@ -95,113 +125,343 @@ def _find_column(df, candidates):
             return col_map[norm]
     return None
 
-@shared_task
-def ingest_customer_data(filename='data/customer_data.xlsx'):
+def _resolve_columns(df, spec):
+    # map every model field to the matching header in df (or None)
+    return {field: _find_column(df, candidates) for field, candidates in spec.items()}
+
+def _batch_size(batch_size=None):
+    return int(batch_size or getattr(settings, 'INGESTION_BATCH_SIZE', 5000))
+
+def _text_column(df, col):
+    if not col:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[col].where(df[col].notna(), '').astype(str)
+
+def _numeric_column(df, col, fill=None):
+    if not col:
+        values = pd.Series(float('nan'), index=df.index)
+    else:
+        values = pd.to_numeric(df[col], errors='coerce')
+    if fill is not None:
+        return values.fillna(fill).astype('int64')
+    return values.round().astype('Int64')
+
+def _float_column(df, col):
+    if not col:
+        return pd.Series(float('nan'), index=df.index)
+    return pd.to_numeric(df[col], errors='coerce')
+
+def _date_column(df, col):
+    if not col:
+        return pd.Series(None, index=df.index, dtype=object)
+    return pd.to_datetime(df[col], errors='coerce').dt.date
+
+def _records(frame):
+    # plain python values with NaN/NA turned into None, ready for model kwargs
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+def _row_hashes(frame):
+    # 64-bit content hash of every row, stored next to the row so an
+    # incremental run can tell which rows actually changed
+    return pd.Series(
+        pd.util.hash_pandas_object(frame, index=False).to_numpy().view('int64'),
+        index=frame.index,
+    )
+
+def _bulk_upsert(model, frame, key, batch_size, skip_unchanged=False, related=None):
+    """
+    Upsert the rows of `frame` into `model` in chunks of `batch_size`,
+    using INSERT ... ON CONFLICT (key) DO UPDATE. Returns a dict with the
+    keys of the rows created and updated and the number left unchanged,
+    counted the same way update_or_create would count them row by row. With
+    skip_unchanged, rows whose row_hash matches the stored one are not
+    written at all. With related (a field name), 'previous' is the set of
+    that field's stored values for the updated rows, e.g. the customers
+    updated loans belonged to before.
+    """
+    frame = frame.assign(row_hash=_row_hashes(frame))
+    update_fields = [c for c in frame.columns if c != key]
+    stored_fields = ['row_hash'] + ([related] if related else [])
+    result = {'created': [], 'updated': [], 'unchanged': 0, 'previous': set()}
+    for start in range(0, len(frame), batch_size):
+        chunk = frame.iloc[start:start + batch_size]
+        # a key may appear twice in a file; the last row wins, as it did before
+        unique = chunk.drop_duplicates(subset=key, keep='last')
+        keys = unique[key].tolist()
+        with transaction.atomic():
+            existing = {
+                row[0]: row[1:]
+                for row in model.objects.filter(**{f'{key}__in': keys}).values_list(key, *stored_fields)
+            }
+            if skip_unchanged and existing:
+                # compared as python ints: a float round trip would merge hashes
+                same = pd.Series(
+                    [k in existing and existing[k][0] == h for k, h in zip(keys, unique['row_hash'].tolist())],
+                    index=unique.index,
+                )
+                unique = unique[~same]
+                result['unchanged'] += int(same.sum())
+            if not unique.empty:
+                model.objects.bulk_create(
+                    [model(**row) for row in _records(unique)],
+                    update_conflicts=True,
+                    unique_fields=[key],
+                    update_fields=update_fields,
+                )
+        # counted on the deduplicated rows, like unchanged: a repeated key is one row
+        for k in unique[key].tolist():
+            if k in existing:
+                result['updated'].append(k)
+                if related:
+                    result['previous'].add(existing[k][1])
+            else:
+                result['created'].append(k)
+    return result
+
+def _customer_frame(df, cols):
+    frame = pd.DataFrame({
+        'customer_id': _numeric_column(df, cols['customer_id']),
+        'first_name': _text_column(df, cols['first_name']),
+        'last_name': _text_column(df, cols['last_name']),
+        'age': _numeric_column(df, cols['age']),
+        'phone_number': _numeric_column(df, cols['phone_number'], fill=0),
+        'monthly_salary': _numeric_column(df, cols['monthly_salary'], fill=0),
+        'approved_limit': _numeric_column(df, cols['approved_limit'], fill=0),
+    }, index=df.index)
+    return frame
+
+def _drop_rows(frame, mask, message):
+    # drop the rows selected by mask, logging how many went; returns (frame, count)
+    count = int(mask.sum())
+    if count:
+        logger.warning(message, count)
+        frame = frame[~mask]
+    return frame, count
+
+def _file_signature(path):
+    stat = Path(path).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def _resume_offset(key, signature):
+    checkpoint = IngestionCheckpoint.objects.filter(key=key).first()
+    if checkpoint and checkpoint.file_signature == signature:
+        return checkpoint.rows_committed
+    return 0
+
+def _ingest_file(path, name, spec, batch_size, incremental, upsert_batch, on_progress=None):
+    """
+    Stream `path` batch by batch through upsert_batch(df, cols) and return
+    the summed counts, or None when the customer id column is missing.
+    In incremental mode the offset of the last committed batch is stored in
+    IngestionCheckpoint, so a restarted task skips the rows already written.
+    on_progress(state) is called after every committed batch (progress.py).
+    """
+    progress = IngestionProgress(name, count_rows(path), on_progress)
+    key = f"{name}:{Path(path).resolve()}"[:255]
+    signature = offset = None
+    if incremental:
+        signature = _file_signature(path)
+        offset = _resume_offset(key, signature)
+        if offset:
+            logger.info("Resuming %s from row %d", path, offset)
+            progress.resumed_at(offset)
+
+    totals = Counter()
+    cols = None
+    # the file is streamed in batches, so memory is bounded by batch_size
+    for df in iter_batches(path, batch_size):
+        if cols is None:
+            # resolve the headers once for the whole file
+            cols = _resolve_columns(df, spec)
+            if not cols['customer_id']:
+                return None
+        if offset:
+            df = df[df.index >= offset]
+            if df.empty:
+                continue
+
+        with transaction.atomic():
+            totals.update(upsert_batch(df, cols))
+            if incremental:
+                IngestionCheckpoint.objects.update_or_create(
+                    key=key,
+                    defaults={'file_signature': signature, 'rows_committed': int(df.index[-1]) + 1},
+                )
+        progress.report(int(df.index[-1]) + 1, totals)
+
+    if incremental:
+        # a finished file starts from the top next time (unchanged rows are skipped by hash)
+        IngestionCheckpoint.objects.filter(key=key).delete()
+    return totals
+
+def _upsert_customer_batch(df, cols, batch_size, skip_unchanged=False):
+    frame = _customer_frame(df, cols)
+    frame, skipped = _drop_rows(frame, frame['customer_id'].isna(), "Skipping %d customer rows with empty customer id")
+    result = _bulk_upsert(Customer, frame, 'customer_id', batch_size, skip_unchanged)
+    # bulk upserts do not send post_save, so drop the cached scores of the
+    # customers written and give new ones their exposure row here (customer
+    # fields do not enter the loan aggregates)
+    score_cache.invalidate_many_on_commit(result['created'] + result['updated'])
+    exposure.refresh(result['created'], batch_size=batch_size)
+    return {'created': len(result['created']), 'updated': len(result['updated']),
+            'unchanged': result['unchanged'], 'skipped': skipped}
+
+def _task_progress(task):
+    # on_progress for a running task: log the progress and publish it as the
+    # task's PROGRESS state (read back by /ingestion-status/<task_id>/)
+    def publish(state):
+        logger.info(format_progress(state))
+        if task.request.id:
+            task.update_state(state='PROGRESS', meta=state)
+    return publish
+
+@shared_task(bind=True)
+@metrics.timed('ingest_customer_data')
+def ingest_customer_data(self, filename='data/customer_data.xlsx', batch_size=None, incremental=False):
+    return load_customers(filename, batch_size, incremental, on_progress=_task_progress(self))
+
+@routers.primary()
+def load_customers(filename='data/customer_data.xlsx', batch_size=None, incremental=False, on_progress=None):
+    # ingest_customer_data without Celery (manage.py ingest)
     path = _project_file_path(filename)
     logger.info("Reading customer file: %s", path)
-    df = pd.read_excel(path)
-    created = updated = 0
-
-    for _, row in df.iterrows():
-        # try to find columns robustly
-        customer_id_col = _find_column(df, ['Customer ID', 'Customer', 'customer_id', 'customer id'])
-        first_col = _find_column(df, ['First Name', 'first_name', 'Firstname', 'first name'])
-        last_col = _find_column(df, ['Last Name', 'last_name', 'Lastname', 'last name'])
-        age_col = _find_column(df, ['Age', 'age'])
-        phone_col = _find_column(df, ['Phone Number', 'Phone', 'phone_number', 'phone'])
-        salary_col = _find_column(df, ['Monthly Salary', 'MonthlySalary', 'monthly_salary', 'salary'])
-        approved_col = _find_column(df, ['Approved Limit', 'approved_limit', 'ApprovedLimit'])
-
-        if not customer_id_col:
-            logger.error("Customer ID column not found in %s", filename)
-            return "Failed: customer id column missing"
-
-        data = {
-            'first_name': row[first_col] if first_col and pd.notna(row[first_col]) else '',
-            'last_name': row[last_col] if last_col and pd.notna(row[last_col]) else '',
-            'age': int(row[age_col]) if age_col and pd.notna(row[age_col]) else None,
-            'phone_number': str(row[phone_col]) if phone_col and pd.notna(row[phone_col]) else '',
-            'monthly_salary': pd.to_numeric(row[salary_col], errors='coerce') if salary_col else None,
-            'approved_limit': pd.to_numeric(row[approved_col], errors='coerce') if approved_col else None,
-        }
-
-        obj, created_flag = Customer.objects.update_or_create(
-            customer_id=row[customer_id_col],
-            defaults=data
+    batch_size = _batch_size(batch_size)
+
+    totals = _ingest_file(
+        path, 'customers', CUSTOMER_COLUMNS, batch_size, incremental,
+        lambda df, cols: _upsert_customer_batch(df, cols, batch_size, incremental),
+        on_progress,
+    )
+    if totals is None:
+        logger.error("Customer ID column not found in %s", filename)
+        return "Failed: customer id column missing"
+
+    created, updated, unchanged = totals['created'], totals['updated'], totals['unchanged']
+    logger.info("Customer ingestion finished: %d created, %d updated, %d unchanged", created, updated, unchanged)
+    result = f"Customer data ingested: {created} created, {updated} updated"
+    if incremental:
+        result += f", {unchanged} unchanged"
+    return result
+
+def _loan_frame(df, cols):
+    frame = pd.DataFrame({
+        'customer_id': _numeric_column(df, cols['customer_id']),
+        'loan_id': _numeric_column(df, cols['loan_id']),
+        'loan_amount': _float_column(df, cols['loan_amount']),
+        'tenure': _numeric_column(df, cols['tenure']),
+        'interest_rate': _float_column(df, cols['interest_rate']),
+        'monthly_repayment': _float_column(df, cols['monthly_repayment']),
+        'emis_paid_on_time': _numeric_column(df, cols['emis_paid_on_time']),
+        'start_date': _date_column(df, cols['start_date']),
+        'end_date': _date_column(df, cols['end_date']),
+    }, index=df.index)
+    return frame
+
+def _upsert_loan_batch(df, cols, known_ids, batch_size, skip_unchanged=False):
+    frame = _loan_frame(df, cols)
+
+    frame, missing_customer = _drop_rows(
+        frame, frame['customer_id'].isna(), "Skipping %d loan rows with empty customer id")
+
+    # anti-join against the preloaded customer ids instead of a
+    # Customer.objects.get per row
+    unknown = ~frame['customer_id'].isin(known_ids)
+    if unknown.any():
+        logger.warning(
+            "Unknown customers in loan file (e.g. %s)",
+            frame.loc[unknown, 'customer_id'].unique()[:10].tolist(),
         )
-        if created_flag:
-            created += 1
-        else:
-            updated += 1
+    frame, unknown_customer = _drop_rows(frame, unknown, "Skipping %d loan rows for unknown customers")
 
-    logger.info("Customer ingestion finished: %d created, %d updated", created, updated)
-    return f"Customer data ingested: {created} created, {updated} updated"
+    frame, missing_loan_id = _drop_rows(
+        frame, frame['loan_id'].isna(), "Skipping %d loan rows because loan id missing")
 
-@shared_task
-def ingest_loan_data(filename='data/loan_data.xlsx'):
+    result = _bulk_upsert(Loan, frame, 'loan_id', batch_size, skip_unchanged, related='customer_id')
+    # bulk upserts do not send post_save, so drop the cached scores and
+    # refresh the exposure rows of the customers whose loans were written
+    # (and of the previous customer of a moved loan) here
+    written = frame['loan_id'].isin(result['created'] + result['updated'])
+    changed_customers = list(set(frame.loc[written, 'customer_id'].tolist()) | result['previous'])
+    score_cache.invalidate_many_on_commit(changed_customers)
+    exposure.refresh(changed_customers, batch_size=batch_size)
+    return {
+        'created': len(result['created']),
+        'updated': len(result['updated']),
+        'unchanged': result['unchanged'],
+        'skipped': missing_customer + unknown_customer + missing_loan_id,
+    }
+
+@shared_task(bind=True)
+@metrics.timed('ingest_loan_data')
+def ingest_loan_data(self, filename='data/loan_data.xlsx', batch_size=None, incremental=False):
+    return load_loans(filename, batch_size, incremental, on_progress=_task_progress(self))
+
+@routers.primary()
+def load_loans(filename='data/loan_data.xlsx', batch_size=None, incremental=False, on_progress=None):
+    # ingest_loan_data without Celery (manage.py ingest)
     path = _project_file_path(filename)
     logger.info("Reading loan file: %s", path)
-    df = pd.read_excel(path)
-    created = updated = skipped = 0
-
-    # Prepare column resolution once (use df.columns)
-    # We'll attempt multiple common header names for each field
-    for _, row in df.iterrows():
-        # find customer id col
-        customer_col = _find_column(df, ['Customer ID', 'Customer', 'customer_id', 'customer id'])
-        loan_id_col = _find_column(df, ['Loan ID', 'LoanId', 'loan_id', 'Loan Id', 'loan id'])
-        loan_amount_col = _find_column(df, ['Loan Amount', 'Amount', 'loan_amount', 'loan amount'])
-        tenure_col = _find_column(df, ['Tenure', 'tenure'])
-        interest_col = _find_column(df, ['Interest Rate', 'Interest', 'interest_rate'])
-        monthly_pay_col = _find_column(df, ['Monthly Payment', 'MonthlyPayment', 'monthly_repayment', 'monthly payment', 'Monthly Payment'])
-        emis_on_time_col = _find_column(df, ['EMIs paid on time', 'EMIs Paid On Time', 'emis_paid_on_time', 'emis paid on time'])
-        start_date_col = _find_column(df, ['Date of Approval', 'Start Date', 'start_date', 'date'])
-        end_date_col = _find_column(df, ['End Date', 'end_date'])
-
-        if not customer_col:
-            logger.error("Customer ID column not found in %s", filename)
-            return "Failed: customer id column missing"
-
-        raw_customer_id = row[customer_col]
-        if pd.isna(raw_customer_id):
-            logger.warning("Skipping row with empty customer id: %s", row.to_dict())
-            skipped += 1
-            continue
-
-        # find customer instance
-        try:
-            customer = Customer.objects.get(customer_id=raw_customer_id)
-        except Customer.DoesNotExist:
-            logger.warning("Customer with id %s not found. Skipping loan row.", raw_customer_id)
-            skipped += 1
-            continue
-
-        # resolve values safely
-        loan_id_val = row[loan_id_col] if loan_id_col and pd.notna(row[loan_id_col]) else None
-        if loan_id_val is None:
-            logger.warning("Skipping loan row for customer %s because loan id missing", raw_customer_id)
-            skipped += 1
-            continue
-
-        defaults = {
-            'customer': customer,
-            'loan_amount': pd.to_numeric(row[loan_amount_col], errors='coerce') if loan_amount_col else None,
-            'tenure': int(row[tenure_col]) if tenure_col and pd.notna(row[tenure_col]) else None,
-            'interest_rate': pd.to_numeric(row[interest_col], errors='coerce') if interest_col else None,
-            'monthly_repayment': pd.to_numeric(row[monthly_pay_col], errors='coerce') if monthly_pay_col else None,
-            'emis_paid_on_time': int(row[emis_on_time_col]) if emis_on_time_col and pd.notna(row[emis_on_time_col]) else None,
-            'start_date': pd.to_datetime(row[start_date_col], errors='coerce') if start_date_col else None,
-            'end_date': pd.to_datetime(row[end_date_col], errors='coerce') if end_date_col else None,
-        }
-
-        obj, created_flag = Loan.objects.update_or_create(
-            loan_id=loan_id_val,
-            defaults=defaults
+    batch_size = _batch_size(batch_size)
+
+    # one query for every known customer id, reused by every batch
+    known_ids = pd.Index(Customer.objects.values_list('customer_id', flat=True))
+
+    totals = _ingest_file(
+        path, 'loans', LOAN_COLUMNS, batch_size, incremental,
+        lambda df, cols: _upsert_loan_batch(df, cols, known_ids, batch_size, incremental),
+        on_progress,
+    )
+    if totals is None:
+        logger.error("Customer ID column not found in %s", filename)
+        return "Failed: customer id column missing"
+
+    created, updated, unchanged, skipped = (
+        totals['created'], totals['updated'], totals['unchanged'], totals['skipped'])
+    logger.info("Loan ingestion finished: %d created, %d updated, %d unchanged, %d skipped",
+                created, updated, unchanged, skipped)
+    result = f"Loan data ingested: {created} created, {updated} updated, {skipped} skipped"
+    if incremental:
+        result += f", {unchanged} unchanged"
+    return result
+
+@shared_task
+@metrics.timed('reconcile_customer_exposure')
+def reconcile_customer_exposure(repair=True):
+    # Nightly (CELERY_BEAT_SCHEDULE): rebuild stale CustomerExposure rows for
+    # the new day and report and repair any that drifted from Loan. Compared
+    # on the primary, where the repairs go, not on a lagging replica.
+    with routers.primary():
+        report = exposure.reconcile(repair=repair)
+    if report['missing'] or report['drifted']:
+        logger.warning(
+            "Customer exposure drift: %d missing, %d drifted (e.g. %s), %d rows repaired",
+            report['missing'], report['drifted'], report['drifted_sample'], report['repaired'],
         )
-        if created_flag:
-            created += 1
-        else:
-            updated += 1
+    logger.info("Customer exposure reconciled: %d checked, %d stale", report['checked'], report['stale'])
+    return report
 
-    logger.info("Loan ingestion finished: %d created, %d updated, %d skipped", created, updated, skipped)
-    return f"Loan data ingested: {created} created, {updated} updated, {skipped} skipped"
+@shared_task
+def rescore_portfolio(shard_size=None):
+    # Score every customer into CustomerScore: one rescore_shard task per
+    # customer_id range, spread over the workers, then rescore_finished
+    computed_at = timezone.now()
+    shards = rescoring.shard_bounds(shard_size)
+    if not shards:
+        return "No customers to score"
+    chord(
+        rescore_shard.s(low, high, computed_at.isoformat()) for low, high in shards
+    )(rescore_finished.s(computed_at.isoformat()))
+    logger.info("Rescoring started: %d shards", len(shards))
+    return f"Rescoring started: {len(shards)} shards"
+
+@shared_task
+@metrics.timed('rescore_shard')
+def rescore_shard(low, high, computed_at):
+    return rescoring.score_shard(low, high, datetime.fromisoformat(computed_at))
+
+@shared_task
+def rescore_finished(counts, computed_at):
+    elapsed = (timezone.now() - datetime.fromisoformat(computed_at)).total_seconds()
+    scored = sum(counts)
+    logger.info("Rescoring finished: %d customers in %.1fs (%.0f/s)", scored, elapsed, scored / max(elapsed, 1e-9))
+    return f"Rescored {scored} customers in {elapsed:.1f}s"
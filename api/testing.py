@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+# Test helpers for keeping the number of queries per request in check.
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin. assertQueryBudget(n) is assertNumQueries with an upper
+    bound: it fails, listing the SQL, when the block runs more than n queries.
+    """
+    @contextmanager
+    def assertQueryBudget(self, budget, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as captured:
+            yield captured
+        executed = len(captured.captured_queries)
+        if executed > budget:
+            queries = "\n".join(
+                f"{i}. {query['sql']}" for i, query in enumerate(captured.captured_queries, start=1)
+            )
+            self.fail(f"{executed} queries executed, budget is {budget}\nCaptured queries were:\n{queries}")
@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.renderers import JSONRenderer
+
+from credit_system import celery_app
+
+from . import amortization, export, exposure, idempotency, rescoring, routers, score_cache, signals, tasks, views
+from . import urls as api_urls
+from .eligibility import current_year_range, evaluate_applications
+from .ids import IdAllocator, customer_ids, loan_ids
+from .middleware import endpoint_report, report
+from .models import Customer, CustomerExposure, CustomerScore, IngestionCheckpoint, Loan
+from .policy import DEFAULT_POLICY, EligibilityPolicy
+from .progress import format_progress
+from .readers import count_rows, iter_batches
+from .renderers import ORJSONRenderer, dumps
+from .routers import PrimaryPinMiddleware, ReplicaRouter
+from .simulation import simulate
+from .serializers import (
+    CustomerLoanSerializer,
+    ViewLoanSerializer,
+    customer_loan_rows,
+    customer_loan_values,
+    view_loan_row,
+)
+from .tasks import ingest_customer_data, load_customers, load_loans, rescore_shard
+from .testing import QueryBudgetMixin
+from .views import CustomerRiskContext, calculate_credit_score, calculate_emi, check_loan_eligibility
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        # test rollbacks do not send delete signals, so cached scores would leak between tests
+        for cache in caches.all():
+            cache.clear()
+        score_cache.reset_stats()
+        # reserved ID blocks would outlive the rolled back counter rows
+        customer_ids.reset()
+        loan_ids.reset()
+
+
+def make_customer(customer_id, monthly_salary=50000, approved_limit=1800000, current_debt=0):
+    return Customer.objects.create(
+        customer_id=customer_id,
+        first_name='Test',
+        last_name=f'Customer {customer_id}',
+        phone_number=9000000000 + customer_id,
+        monthly_salary=monthly_salary,
+        approved_limit=approved_limit,
+        current_debt=current_debt,
+    )
+
+
+def make_loan(customer, loan_id, tenure=12, emis_paid_on_time=12, start_date=date(2015, 1, 1),
+              end_date=date(2016, 1, 1), monthly_repayment=1000, loan_amount=10000):
+    return Loan.objects.create(
+        customer=customer,
+        loan_id=loan_id,
+        loan_amount=loan_amount,
+        tenure=tenure,
+        interest_rate=Decimal('10.00'),
+        monthly_repayment=monthly_repayment,
+        emis_paid_on_time=emis_paid_on_time,
+        start_date=start_date,
+        end_date=end_date,
+    )
+
+
+def legacy_credit_score(customer_id):
+    # The original per-query implementation, kept as the reference the
+    # single-query version must agree with.
+    score = 100
+    try:
+        customer = Customer.objects.get(customer_id=customer_id)
+        loans = Loan.objects.filter(customer=customer)
+        if customer.current_debt > customer.approved_limit:
+            return 0
+        total_emis = sum(loan.tenure for loan in loans)
+        total_paid_on_time = sum(loan.emis_paid_on_time for loan in loans)
+        if total_emis > 0:
+            payment_ratio = total_paid_on_time / total_emis
+            if payment_ratio < 0.8: score -= 30
+            elif payment_ratio < 0.9: score -= 15
+        if loans.count() > 5:
+            score -= 20
+        current_year_loans = loans.filter(start_date__year=datetime.now().year).count()
+        if current_year_loans > 3:
+            score -= 25
+        return max(score, 0)
+    except Customer.DoesNotExist:
+        return 0
+
+
+class CreditScoreTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        this_year = date(datetime.now().year, 1, 15)
+        loan_id = 1
+
+        def loans(customer, count, **kwargs):
+            nonlocal loan_id
+            for _ in range(count):
+                make_loan(customer, loan_id, **kwargs)
+                loan_id += 1
+
+        make_customer(1)                                   # no loans
+        loans(make_customer(2), 2)                         # clean history
+        loans(make_customer(3), 3, emis_paid_on_time=10)   # ratio between 0.8 and 0.9
+        loans(make_customer(4), 2, emis_paid_on_time=6)    # ratio below 0.8
+        loans(make_customer(5), 7)                         # many loans
+        loans(make_customer(6), 5, start_date=this_year)   # busy current year
+        loans(make_customer(7), 8, emis_paid_on_time=1, start_date=this_year)
+        loans(make_customer(8, approved_limit=1000, current_debt=5000), 1)
+
+    def test_scores_match_legacy_implementation(self):
+        for customer_id in range(1, 10):
+            with self.subTest(customer_id=customer_id):
+                self.assertEqual(calculate_credit_score(customer_id), legacy_credit_score(customer_id))
+
+    def test_score_uses_a_single_query(self):
+        with self.assertNumQueries(1):
+            calculate_credit_score(7)
+
+    def test_unknown_customer_scores_zero(self):
+        self.assertEqual(calculate_credit_score(999), 0)
+
+
+class EligibilityTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer(1, monthly_salary=100000)
+        make_loan(cls.customer, 1, end_date=date(2999, 1, 1), monthly_repayment=20000)
+        make_loan(cls.customer, 2, end_date=date(2000, 1, 1), monthly_repayment=90000)
+
+    def test_eligibility_uses_a_single_query(self):
+        with self.assertNumQueries(1):
+            result = check_loan_eligibility(1, 100000, 14, 12)
+        self.assertTrue(result['approval'])
+        self.assertEqual(result['monthly_installment'], calculate_emi(100000, 14, 12))
+
+    def test_only_running_loans_count_towards_emi_limit(self):
+        # 20000 running + ~25k new stays under 50% of salary, the ended loan is ignored
+        self.assertTrue(check_loan_eligibility(1, 300000, 14, 12)['approval'])
+        # 20000 running + ~36k new goes over it
+        result = check_loan_eligibility(1, 400000, 14, 12)
+        self.assertFalse(result['approval'])
+        self.assertEqual(result['message'], 'Total EMI exceeds 50% of monthly salary')
+
+    def test_unknown_customer(self):
+        self.assertEqual(check_loan_eligibility(999, 1000, 14, 12)['message'], 'Customer not found')
+
+
+def make_portfolio(n_customers=40):
+    # a spread of histories so every score tier and the salary check are hit
+    this_year = date(datetime.now().year, 2, 1)
+    loan_id = 1
+    for customer_id in range(1, n_customers + 1):
+        customer = make_customer(
+            customer_id,
+            monthly_salary=20000 + 5000 * (customer_id % 7),
+            approved_limit=10 ** 6 if customer_id % 9 else 100,
+            current_debt=1000,
+        )
+        for n in range(customer_id % 9):
+            make_loan(
+                customer, loan_id,
+                tenure=12,
+                emis_paid_on_time=12 - (customer_id % 4) * (n % 2) * 2,
+                start_date=this_year if n % 3 == 0 else date(2015, 1, 1),
+                end_date=date(2999, 1, 1) if n % 2 else date(2001, 1, 1),
+                monthly_repayment=1500,
+            )
+            loan_id += 1
+
+
+class BatchEligibilityTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_portfolio()
+
+    def test_batch_matches_single_checks(self):
+        applications = [
+            {'customer_id': customer_id, 'loan_amount': amount, 'interest_rate': rate, 'tenure': 24}
+            for customer_id in range(1, 43)
+            for amount, rate in ((50000, 8), (150000, 13), (400000, 20))
+        ]
+        results = self.client.post('/api/check-eligibility/batch/', applications, content_type='application/json').json()['results']
+
+        self.assertEqual(len(results), len(applications))
+        for app, result in zip(applications, results):
+            expected = check_loan_eligibility(app['customer_id'], app['loan_amount'], app['interest_rate'], app['tenure'])
+            with self.subTest(**app):
+                self.assertEqual(result['customer_id'], app['customer_id'])
+                self.assertEqual(result['approval'], expected['approval'])
+                if expected['approval']:
+                    self.assertEqual(result['corrected_interest_rate'], expected['corrected_interest_rate'])
+                    self.assertAlmostEqual(result['monthly_installment'], expected['monthly_installment'], places=2)
+                else:
+                    self.assertEqual(result['message'], expected['message'])
+
+    def test_batch_uses_a_single_query(self):
+        applications = [{'customer_id': i, 'loan_amount': 1000, 'interest_rate': 10, 'tenure': 12} for i in range(1, 41)]
+        with self.assertNumQueries(1):
+            evaluate_applications(applications)
+
+    def test_invalid_payload(self):
+        response = self.client.post('/api/check-eligibility/batch/', {'applications': 'nope'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ids_that_are_not_customer_ids_are_invalid(self):
+        applications = [{'customer_id': customer_id, 'loan_amount': 1000, 'interest_rate': 10, 'tenure': 12}
+                        for customer_id in (1e30, 1.5, -1e12, 'x', 1)]
+        response = self.client.post('/api/check-eligibility/batch/', applications, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r.get('message') for r in results[:4]], ['Invalid application'] * 4)
+        self.assertTrue(results[4]['approval'])
+
+
+class PolicySimulationTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_portfolio()
+        cls.admin = User.objects.create_user('admin', is_staff=True)
+
+    def approvals(self, policy, loan_amount=150000, interest_rate=13, tenure=24):
+        return {
+            customer_id for customer_id in range(1, 41)
+            if check_loan_eligibility(customer_id, loan_amount, interest_rate, tenure, policy=policy)['approval']
+        }
+
+    def test_simulation_matches_single_checks(self):
+        policy = EligibilityPolicy(min_score=0, medium_rate=11.0, max_emi_share=0.7)
+        report = simulate(policy, 150000, 13, 24)
+        before, after = self.approvals(DEFAULT_POLICY), self.approvals(policy)
+        self.assertEqual(report['customers'], 40)
+        self.assertEqual(report['baseline']['approved'], len(before))
+        self.assertEqual(report['proposed']['approved'], len(after))
+        self.assertEqual(report['delta']['approval_rate'], round((len(after) - len(before)) / 40, 6))
+        self.assertEqual(report['newly_approved'], len(after - before))
+        self.assertEqual(report['newly_rejected'], len(before - after))
+        self.assertGreater(report['newly_approved'], 0)
+
+    def test_current_policy_changes_nothing(self):
+        report = simulate(EligibilityPolicy(), 400000, 8, 12)
+        self.assertEqual(report['baseline'], report['proposed'])
+        self.assertEqual(set(report['delta'].values()) - {None}, {0})
+
+    def test_policy_thresholds_are_validated(self):
+        self.assertEqual(EligibilityPolicy.from_dict({'low_rate': 18}).low_rate, 18.0)
+        for data in ({'max_score': 1}, {'prime_score': 'high'}, {'medium_score': 60}, {'max_emi_share': 0}):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                EligibilityPolicy.from_dict(data)
+
+    def test_endpoint_is_staff_only(self):
+        payload = {'loan_amount': 150000, 'interest_rate': 13, 'tenure': 24, 'policy': {'max_emi_share': 0.7}}
+        response = self.client.post('/api/simulate-policy/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.admin)
+        response = self.client.post('/api/simulate-policy/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['proposed']['policy']['max_emi_share'], 0.7)
+        response = self.client.post('/api/simulate-policy/', {**payload, 'tenure': 0}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('simulate_policy', '--loan-amount', '150000', '--interest-rate', '13', '--tenure', '24',
+                     '--max-emi-share', '0.7', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['proposed']['approved'], len(self.approvals(EligibilityPolicy(max_emi_share=0.7))))
+
+
+class AmortizationTests(ApiTestCase):
+    def test_emi_matches_scalar_helper(self):
+        principal = [100000, 250000, 5000, 100000, 100000]
+        rate = [12, 8.5, 18, 0, 12]
+        tenure = [12, 60, 6, 10, 0]
+        expected = [calculate_emi(p, r, n) for p, r, n in zip(principal, rate, tenure)]
+        self.assertEqual(amortization.emi(principal, rate, tenure).tolist(), expected)
+
+    def test_schedule_repays_principal(self):
+        plan = amortization.schedule([100000, 60000], [12, 0], [12, 6])
+        self.assertEqual(plan['payment'].shape, (2, 12))
+        self.assertAlmostEqual(plan['principal'][0].sum(), 100000, places=6)
+        self.assertAlmostEqual(plan['principal'][1].sum(), 60000, places=6)
+        self.assertEqual(plan['balance'][0, -1], 0)
+        # padding past the shorter loan's tenure
+        self.assertEqual(plan['payment'][1, 6:].tolist(), [0] * 6)
+        # balances agree with the closed form
+        balances = amortization.outstanding_balance(100000, 12, 12, range(1, 12))
+        self.assertTrue(np.allclose(plan['balance'][0, :11], balances))
+
+    def test_portfolio_outstanding_matches_per_loan(self):
+        customer = make_customer(1)
+        for loan_id, (amount, paid) in enumerate([(100000, 0), (200000, 6), (50000, 12)], start=1):
+            make_loan(customer, loan_id, loan_amount=amount, tenure=12, emis_paid_on_time=paid)
+
+        with self.assertNumQueries(1):
+            frame = amortization.portfolio_outstanding(Loan.objects.all())
+
+        for loan in Loan.objects.all():
+            expected = amortization.outstanding_balance(loan.loan_amount, loan.interest_rate, loan.tenure, loan.emis_paid_on_time)
+            self.assertAlmostEqual(frame.loc[loan.loan_id, 'outstanding_balance'], float(expected), places=2)
+        self.assertEqual(frame.loc[1, 'outstanding_balance'], 100000)
+        self.assertEqual(frame.loc[3, 'outstanding_balance'], 0)
+
+    def test_amortization_endpoint(self):
+        loan = make_loan(make_customer(1), 1, loan_amount=120000, tenure=12, emis_paid_on_time=3)
+        response = self.client.get(f'/api/amortization/{loan.id}/')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(len(body['schedule']), 12)
+        self.assertEqual(body['schedule'][2]['balance'], body['outstanding_balance'])
+        self.assertEqual(body['schedule'][-1]['balance'], 0)
+
+        self.assertEqual(self.client.get('/api/amortization/999/').status_code, 404)
+
+
+class ScoreCacheTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer(1, monthly_salary=100000)
+        make_loan(cls.customer, 1, end_date=date(2999, 1, 1), monthly_repayment=20000)
+
+    def test_second_check_is_served_from_cache(self):
+        first = check_loan_eligibility(1, 100000, 14, 12)
+        with self.assertNumQueries(0):
+            second = check_loan_eligibility(1, 100000, 14, 12)
+        self.assertEqual(first, second)
+        self.assertEqual(score_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_cached_context_matches_database(self):
+        fresh = CustomerRiskContext.load(1)
+        cached = CustomerRiskContext.load(1)
+        self.assertEqual(cached.credit_score, fresh.credit_score)
+        self.assertEqual(cached.current_emis_sum, fresh.current_emis_sum)
+        self.assertEqual(cached.customer.monthly_salary, 100000)
+
+    def test_loan_writes_invalidate(self):
+        CustomerRiskContext.load(1)
+        make_loan(self.customer, 2, end_date=date(2999, 1, 1), monthly_repayment=5000)
+        self.assertEqual(CustomerRiskContext.load(1).current_emis_sum, 25000)
+
+        Loan.objects.get(loan_id=2).delete()
+        self.assertEqual(CustomerRiskContext.load(1).current_emis_sum, 20000)
+        self.assertEqual(score_cache.stats()['hits'], 0)
+
+    def test_replica_reads_do_not_refill_a_fresh_invalidation(self):
+        customer = CustomerRiskContext.load(1).customer
+        score_cache.invalidate(1)
+        with override_settings(DATABASE_REPLICAS=['replica1']):
+            # inputs from a replica that may not have the write yet
+            score_cache.store(customer)
+            self.assertIsNone(score_cache.get(1))
+            with routers.primary():
+                score_cache.store(customer)
+            self.assertIsNotNone(score_cache.get(1))
+
+            with override_settings(DATABASE_REPLICA_MAX_LAG=0):
+                score_cache.invalidate(1)
+            score_cache.store(customer)
+            self.assertIsNotNone(score_cache.get(1))
+
+    def test_customer_writes_invalidate(self):
+        self.assertEqual(calculate_credit_score(1), 100)
+        self.customer.current_debt = 10 ** 7
+        self.customer.save()
+        self.assertEqual(calculate_credit_score(1), 0)
+
+
+class ExposureTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        this_year = date(datetime.now().year, 1, 15)
+        cls.customer = make_customer(1, monthly_salary=100000)
+        make_loan(cls.customer, 1)
+        make_loan(cls.customer, 2, start_date=this_year, end_date=date(2999, 1, 1), monthly_repayment=2500)
+        make_loan(make_customer(2), 3, emis_paid_on_time=3)
+        make_customer(3)
+
+    def stored(self, customer_id):
+        return CustomerExposure.objects.filter(customer_id=customer_id).values(*exposure.EXPOSURE_FIELDS).get()
+
+    def assertExposureCurrent(self, customer_id):
+        self.assertEqual(self.stored(customer_id), exposure.live_exposures([customer_id])[customer_id])
+
+    def make_stale(self, *customer_ids):
+        CustomerExposure.objects.filter(customer_id__in=customer_ids).update(as_of=date(2000, 1, 1))
+
+    def test_rows_follow_loan_writes(self):
+        for customer_id in (1, 2, 3):
+            self.assertExposureCurrent(customer_id)
+        self.assertEqual(self.stored(1)['current_emis_sum'], 2500)
+
+        loan = make_loan(self.customer, 4, end_date=date(2999, 1, 1), monthly_repayment=500)
+        self.assertExposureCurrent(1)
+        loan.emis_paid_on_time = 2
+        loan.save()
+        self.assertExposureCurrent(1)
+        loan.delete()
+        self.assertExposureCurrent(1)
+        self.assertEqual(self.stored(1)['loan_count'], 2)
+
+    def test_moving_a_loan_updates_both_customers(self):
+        self.assertEqual(CustomerRiskContext.load(1).current_emis_sum, 2500)
+        self.assertEqual(CustomerRiskContext.load(3).current_emis_sum, 0)
+        loan = Loan.objects.get(loan_id=2)
+        loan.customer_id = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            loan.save()
+        for customer_id in (1, 3):
+            self.assertExposureCurrent(customer_id)
+        self.assertEqual((self.stored(1)['loan_count'], self.stored(3)['loan_count']), (1, 1))
+        self.assertEqual(CustomerRiskContext.load(1).current_emis_sum, 0)
+        self.assertEqual(CustomerRiskContext.load(3).current_emis_sum, 2500)
+
+        loan.emis_paid_on_time = 1
+        with self.assertNumQueries(0):
+            # nothing to look up when the customer is not being saved
+            signals.remember_loan_customer(Loan, loan, using='default', update_fields=['emis_paid_on_time'])
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_rows_are_written_from_primary_reads_outside_requests(self):
+        # The test databases have no replica alias, so any upkeep read routed
+        # to one would fail
+        with routers.primary():
+            loan = Loan.objects.get(loan_id=2)
+            customer = Customer.objects.get(customer_id=3)
+        loan.customer = customer
+        loan.save()
+        make_loan(customer, 4, end_date=date(2999, 1, 1), monthly_repayment=500)
+        CustomerExposure.objects.filter(customer_id=3).update(as_of=date(2000, 1, 1))
+        make_loan(customer, 5)
+        loan.delete()
+        with routers.primary():
+            for customer_id in (1, 3):
+                self.assertExposureCurrent(customer_id)
+
+    def test_scores_read_one_row_and_fall_back_when_stale(self):
+        with self.assertNumQueries(1):
+            fresh = CustomerRiskContext.load(1, use_cache=False)
+        self.make_stale(1)
+        with self.assertNumQueries(2):
+            live = CustomerRiskContext.load(1, use_cache=False)
+        self.assertEqual((live.credit_score, live.current_emis_sum), (fresh.credit_score, fresh.current_emis_sum))
+        self.assertEqual(live.credit_score, legacy_credit_score(1))
+
+        application = {'customer_id': 1, 'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12}
+        single = check_loan_eligibility(**application)
+        batch = evaluate_applications([application])[0]
+        self.assertEqual(batch['monthly_installment'], single['monthly_installment'])
+
+    def test_reconcile_reports_and_repairs_drift(self):
+        Loan.objects.filter(customer_id=2).update(emis_paid_on_time=0) # no signals
+        CustomerExposure.objects.filter(customer_id=3).delete()
+        self.make_stale(1)
+
+        report = exposure.reconcile()
+        self.assertEqual(report['checked'], 3)
+        self.assertEqual((report['missing'], report['stale'], report['drifted']), (1, 1, 1))
+        self.assertEqual(report['drifted_sample'], [2])
+        self.assertEqual(report['repaired'], 3)
+        for customer_id in (1, 2, 3):
+            self.assertExposureCurrent(customer_id)
+
+        report = exposure.reconcile()
+        self.assertEqual((report['missing'], report['stale'], report['drifted'], report['repaired']), (0, 0, 0, 0))
+
+
+class RescoringTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        this_year = date(datetime.now().year, 1, 15)
+        loan_id = 1
+        for customer_id in range(1, 24):
+            customer = make_customer(customer_id, approved_limit=1000 if customer_id % 11 == 0 else 1800000,
+                                     current_debt=5000)
+            for n in range(customer_id % 9):
+                make_loan(customer, loan_id, emis_paid_on_time=(customer_id + n) % 13,
+                          start_date=this_year if customer_id % 4 == 0 else date(2015, 1, 1))
+                loan_id += 1
+
+    def test_shards_cover_the_customer_range(self):
+        self.assertEqual(rescoring.shard_bounds(10), [(1, 11), (11, 21), (21, 24)])
+        self.assertEqual(rescoring.shard_bounds(100), [(1, 24)])
+
+    def test_stored_scores_match_calculate_credit_score(self):
+        computed_at = timezone.now()
+        counts = [rescore_shard(low, high, computed_at.isoformat()) for low, high in rescoring.shard_bounds(7)]
+        self.assertEqual(sum(counts), 23)
+
+        stored = dict(CustomerScore.objects.values_list('customer_id', 'credit_score'))
+        self.assertEqual(stored, {customer_id: legacy_credit_score(customer_id) for customer_id in range(1, 24)})
+        self.assertEqual(set(CustomerScore.objects.values_list('computed_at', flat=True)), {computed_at})
+
+    def test_rescoring_overwrites_and_reads_stale_exposure_live(self):
+        rescoring.score_shard(1, 24, timezone.now())
+        Loan.objects.filter(customer_id=8).update(emis_paid_on_time=0)
+        CustomerExposure.objects.update(as_of=date(2000, 1, 1))
+        exposure.refresh(range(1, 8)) # a mix of current and stale rows
+        later = timezone.now()
+        with self.assertNumQueries(3): # current rows, live aggregate, upsert
+            rescoring.score_shard(1, 24, later)
+        self.assertEqual(CustomerScore.objects.get(customer_id=8).credit_score, legacy_credit_score(8))
+        self.assertEqual(CustomerScore.objects.filter(computed_at=later).count(), 23)
+
+
+class IdAllocatorTests(ApiTestCase):
+    def test_ids_are_unique_and_reserved_in_blocks(self):
+        allocator = IdAllocator('customer', Customer, 'customer_id', block_size=5)
+        first = allocator.next_id()
+        with self.assertNumQueries(0):
+            rest = [allocator.next_id() for _ in range(4)]
+        ids = [first] + rest + [allocator.next_id() for _ in range(10)]
+        self.assertEqual(len(set(ids)), 15)
+        self.assertEqual(ids, sorted(ids))
+
+    def test_allocators_share_the_counter(self):
+        a = IdAllocator('loan', Loan, 'loan_id', block_size=3)
+        b = IdAllocator('loan', Loan, 'loan_id', block_size=3)
+        ids = [a.next_id(), b.next_id(), a.next_id(), b.next_id(), a.next_id(), b.next_id(), a.next_id()]
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_rolled_back_reservation_is_not_handed_out_again(self):
+        first = IdAllocator('loan', Loan, 'loan_id', block_size=5)
+        second = IdAllocator('loan', Loan, 'loan_id', block_size=5)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            first.next_id()
+            raise RuntimeError("create-loan failed")
+        # the rollback undid the counter update: second gets the range again,
+        # so first must not still hold any of it
+        ids = [second.next_id() for _ in range(5)] + [first.next_id() for _ in range(5)]
+        self.assertEqual(len(set(ids)), 10)
+
+    def test_failed_create_loan_does_not_leak_ids(self):
+        make_customer(1, monthly_salary=100000, approved_limit=5000000)
+        payload = {'customer_id': 1, 'loan_amount': 100000, 'interest_rate': 14, 'tenure': 12.5}
+        response = self.client.post('/api/create-loan/', payload, content_type='application/json')
+        self.assertFalse(response.json()['loan_approved'])
+        other = IdAllocator('loan', Loan, 'loan_id', block_size=5)
+        ids = [other.next_id() for _ in range(5)] + [loan_ids.next_id() for _ in range(5)]
+        self.assertEqual(len(set(ids)), 10)
+
+    def test_ids_start_above_existing_rows(self):
+        make_customer(500)
+        allocator = IdAllocator('customer', Customer, 'customer_id', block_size=5)
+        self.assertEqual(allocator.next_id(), 501)
+
+    def test_register_uses_allocator(self):
+        make_customer(41)
+        payload = {'first_name': 'A', 'last_name': 'B', 'age': 30, 'monthly_income': 50000, 'phone_number': 9999999999}
+        first = self.client.post('/api/register/', payload, content_type='application/json').json()
+        second = self.client.post('/api/register/', payload, content_type='application/json').json()
+        self.assertGreater(first['customer_id'], 41)
+        self.assertNotEqual(first['customer_id'], second['customer_id'])
+        self.assertEqual(first['approved_limit'], 1800000)
+
+
+class CreateLoanTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_customer(1, monthly_salary=100000, approved_limit=5000000, current_debt=1000)
+
+    def create(self, customer_id=1, loan_amount=200000):
+        payload = {'customer_id': customer_id, 'loan_amount': loan_amount, 'interest_rate': 14, 'tenure': 12}
+        return self.client.post('/api/create-loan/', payload, content_type='application/json')
+
+    def test_create_loan_updates_debt(self):
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['loan_approved'])
+        self.assertEqual(Customer.objects.get(pk=1).current_debt, Decimal('201000'))
+        self.assertEqual(Loan.objects.get(pk=response.json()['loan_id']).loan_amount, 200000)
+
+    def test_unknown_customer_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.create(customer_id=999)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'loan_id': None, 'customer_id': 999, 'loan_approved': False,
+                                           'message': 'Customer not found', 'monthly_installment': None})
+
+    def test_emi_limit_holds_across_sequential_loans(self):
+        # each loan costs ~18k a month against a 50k limit
+        results = [self.create().json()['loan_approved'] for _ in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(Loan.objects.count(), 2)
+
+
+class IdempotencyTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_customer(1, monthly_salary=100000, approved_limit=5000000)
+
+    def post(self, path, payload, key):
+        return self.client.post(path, payload, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_create_loan_creates_one_loan(self):
+        payload = {'customer_id': 1, 'loan_amount': 200000, 'interest_rate': 14, 'tenure': 12}
+        first = self.post('/api/create-loan/', payload, 'loan-1')
+        with self.assertNumQueries(0):
+            retry = self.post('/api/create-loan/', payload, 'loan-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Loan.objects.count(), 1)
+
+        self.assertEqual(self.post('/api/create-loan/', payload, 'loan-2').status_code, 201)
+        self.assertEqual(Loan.objects.count(), 2)
+
+    def test_retried_register_creates_one_customer(self):
+        payload = {'first_name': 'A', 'last_name': 'B', 'age': 30, 'monthly_income': 50000, 'phone_number': 9999999999}
+        first = self.post('/api/register/', payload, 'customer-1').json()
+        retry = self.post('/api/register/', payload, 'customer-1').json()
+        self.assertEqual(first, retry)
+        self.assertEqual(Customer.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        payload = {'customer_id': 1, 'loan_amount': 200000, 'interest_rate': 14, 'tenure': 12}
+        self.post('/api/create-loan/', payload, 'loan-1')
+        response = self.post('/api/create-loan/', {**payload, 'loan_amount': 300000}, 'loan-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Loan.objects.count(), 1)
+
+    def test_retry_while_first_attempt_runs(self):
+        caches['idempotency'].add('idempotency:create-loan:loan-1:lock', 'x')
+        payload = {'customer_id': 1, 'loan_amount': 200000, 'interest_rate': 14, 'tenure': 12}
+        self.assertEqual(self.post('/api/create-loan/', payload, 'loan-1').status_code, 409)
+        self.assertEqual(Loan.objects.count(), 0)
+
+    def test_identical_eligibility_checks_in_flight_share_one_computation(self):
+        calls = []
+
+        def slow_check(*args):
+            calls.append(args)
+            time.sleep(0.2)
+            return {'approval': True, 'customer_id': args[0], 'interest_rate': args[2],
+                    'corrected_interest_rate': args[2], 'tenure': args[3], 'monthly_installment': 1.0}
+
+        def check(loan_amount):
+            payload = {'customer_id': 1, 'loan_amount': loan_amount, 'interest_rate': 14, 'tenure': 12}
+            return Client().post('/api/check-eligibility/', payload, content_type='application/json').json()
+
+        with mock.patch.object(views, 'check_loan_eligibility', slow_check):
+            with ThreadPoolExecutor(max_workers=6) as pool:
+                results = list(pool.map(check, [100000] * 5 + [200000]))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results[:5], [results[0]] * 5)
+        self.assertEqual(views.eligibility_checks.in_flight(), 0)
+
+    def test_single_flight_keeps_nothing_after_a_call(self):
+        flight = idempotency.SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('key', lambda: 1 / 0)
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CreateLoanConcurrencyTests(TransactionTestCase):
+    # Needs a database with real row locks (PostgreSQL); SQLite serializes
+    # whole-database writes and cannot run these threads side by side.
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        for customer_id in range(1, 21):
+            make_customer(customer_id, monthly_salary=100000, approved_limit=10 ** 8)
+
+    def run_concurrently(self, customer_ids, workers=10):
+        def apply(customer_id):
+            try:
+                payload = {'customer_id': customer_id, 'loan_amount': 200000, 'interest_rate': 14, 'tenure': 12}
+                return Client().post('/api/create-loan/', payload, content_type='application/json').json()
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(apply, customer_ids))
+        return results, time.perf_counter() - start
+
+    def test_same_customer_cannot_exceed_emi_limit(self):
+        results, _ = self.run_concurrently([1] * 20)
+        # only two ~18k EMIs fit under 50% of a 100k salary
+        self.assertEqual(sum(r['loan_approved'] for r in results), 2)
+        self.assertEqual(Loan.objects.filter(customer_id=1).count(), 2)
+        self.assertEqual(Customer.objects.get(pk=1).current_debt, Decimal('400000'))
+
+    def test_different_customers_do_not_block_each_other(self):
+        # hold customer 1's row lock while the other customers apply: they
+        # must all finish before it is released
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(Customer.objects.select_for_update().filter(pk=1))
+                    locked.set()
+                    release.wait(30)
+            finally:
+                connections.close_all()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            results, _ = self.run_concurrently(list(range(2, 21)) * 2, workers=20)
+            self.assertTrue(holder.is_alive(), "requests waited for another customer's lock")
+        finally:
+            release.set()
+            holder.join()
+        self.assertTrue(all(r['loan_approved'] for r in results), results)
+        self.assertEqual(Loan.objects.count(), 38)
+        self.assertEqual(len(set(Loan.objects.values_list('loan_id', flat=True))), 38)
+
+
+class ViewCustomerLoansTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = make_customer(1)
+        for loan_id in range(1, 26):
+            make_loan(customer, loan_id, emis_paid_on_time=loan_id % 12)
+        make_loan(make_customer(2), 100)
+
+    def test_cursor_pages_cover_every_loan_once(self):
+        url, seen = '/api/view-loans/1/?page_size=10', []
+        while url:
+            with self.assertNumQueries(1):
+                body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 10)
+            seen += [loan['loan_id'] for loan in body['results']]
+            url = body['next']
+        expected = list(Loan.objects.filter(customer_id=1).order_by('id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_stream_returns_all_loans(self):
+        response = self.client.get('/api/view-loans/1/?stream=1')
+        self.assertTrue(response.streaming)
+        rows = json.loads(b''.join(response.streaming_content))
+        paged = self.client.get('/api/view-loans/1/?page_size=1000').json()['results']
+        self.assertEqual(rows, paged)
+        self.assertEqual(rows[0]['repayments_left'], 12 - 1)
+
+
+class AsyncViewTests(ApiTestCase):
+    # The async views must answer exactly like their sync counterparts
+    @classmethod
+    def setUpTestData(cls):
+        customer = make_customer(1, monthly_salary=60000)
+        cls.loans = [make_loan(customer, loan_id, emis_paid_on_time=loan_id % 12) for loan_id in range(1, 16)]
+        make_customer(2, current_debt=5000000)
+
+    async def test_check_eligibility_matches_sync_view(self):
+        for customer_id, amount, rate in [(1, 100000, 10), (1, 5000000, 10), (2, 100000, 10), (99, 1, 10)]:
+            application = {'customer_id': customer_id, 'loan_amount': amount, 'interest_rate': rate, 'tenure': 12}
+            with self.subTest(application=application):
+                expected = (await self.async_client.post(
+                    '/api/check-eligibility/', application, content_type='application/json')).json()
+                response = await self.async_client.post(
+                    '/api/async/check-eligibility/', application, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected)
+
+    async def test_check_eligibility_rejects_malformed_bodies(self):
+        for body in ('[1, 2]', '"text"', 'not json'):
+            with self.subTest(body=body):
+                response = await self.async_client.post(
+                    '/api/async/check-eligibility/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    async def test_view_loan_matches_sync_view(self):
+        loan_id = self.loans[3].id
+        expected = (await self.async_client.get(f'/api/view-loan/{loan_id}/')).json()
+        self.assertEqual((await self.async_client.get(f'/api/async/view-loan/{loan_id}/')).json(), expected)
+        self.assertEqual((await self.async_client.get('/api/async/view-loan/999/')).status_code, 404)
+
+    async def test_view_loans_pages_match_sync_view(self):
+        sync_url, async_url = '/api/view-loans/1/?page_size=4', '/api/async/view-loans/1/?page_size=4'
+        while sync_url:
+            expected = (await self.async_client.get(sync_url)).json()
+            body = (await self.async_client.get(async_url)).json()
+            self.assertEqual(body['results'], expected['results'])
+            self.assertEqual(body['next'] is None, expected['next'] is None)
+            sync_url, async_url = expected['next'], body['next']
+
+        previous = (await self.async_client.get(body['previous'])).json()
+        self.assertEqual([loan['loan_id'] for loan in previous['results']],
+                         [loan.id for loan in self.loans[8:12]])
+
+    async def test_stream_returns_all_loans(self):
+        response = await self.async_client.get('/api/async/view-loans/1/?stream=1')
+        rows = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        expected = (await self.async_client.get('/api/view-loans/1/?page_size=1000')).json()['results']
+        self.assertEqual(rows, expected)
+
+    @override_settings(DEBUG=True)
+    async def test_queries_are_counted_on_the_async_path(self):
+        response = await self.async_client.get(f'/api/async/view-loan/{self.loans[0].id}/')
+        self.assertEqual(response['X-DB-Queries'], '1')
+
+
+class ExportTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = make_customer(1)
+        make_loan(customer, 1, start_date=date(2020, 3, 1), end_date=date(2021, 3, 1))
+        make_loan(customer, 2, start_date=date(2021, 6, 1), end_date=date(2999, 1, 1), monthly_repayment=Decimal('1234.50'))
+        make_loan(make_customer(2), 3, start_date=date(2022, 1, 1), end_date=date(2999, 1, 1))
+        cls.admin = User.objects.create_user('admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def csv_rows(self, url):
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        return list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_csv_export_joins_customers(self):
+        rows = self.csv_rows('/api/export/loans.csv')
+        self.assertEqual([row['loan_id'] for row in rows], ['1', '2', '3'])
+        self.assertEqual(list(rows[1]), list(export.EXPORT_COLUMNS))
+        self.assertEqual((rows[1]['first_name'], rows[1]['monthly_repayment']), ('Test', '1234.50'))
+        self.assertEqual(rows[2]['last_name'], 'Customer 2')
+
+    def test_filters(self):
+        self.assertEqual([r['loan_id'] for r in self.csv_rows('/api/export/loans.csv?active=true')], ['2', '3'])
+        self.assertEqual([r['loan_id'] for r in self.csv_rows('/api/export/loans.csv?active=false')], ['1'])
+        self.assertEqual([r['loan_id'] for r in self.csv_rows('/api/export/loans.csv?start=2021-01-01&end=2021-12-31')], ['2'])
+        self.assertEqual(self.client.get('/api/export/loans.csv?start=soon').status_code, 400)
+        self.assertEqual(self.client.get('/api/export/loans.xml').status_code, 404)
+
+    def test_parquet_export_matches_csv(self):
+        import pyarrow.parquet as pq
+
+        response = self.client.get('/api/export/loans.parquet?active=true')
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column_names, list(export.EXPORT_COLUMNS))
+        self.assertEqual(table.column('loan_id').to_pylist(), [2, 3])
+        self.assertEqual(table.column('monthly_repayment').to_pylist()[0], Decimal('1234.50'))
+
+    def test_export_is_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/export/loans.csv').status_code, 403)
+        self.client.force_login(User.objects.create_user('clerk'))
+        self.assertEqual(self.client.get('/api/export/loans.csv').status_code, 403)
+
+    def test_rows_are_streamed_in_chunks(self):
+        chunks = list(export.iter_csv(export.export_rows(chunk_size=1), chunk_size=1))
+        self.assertEqual(len(chunks), 4) # header + one per loan
+
+
+class MetricsTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_loan(make_customer(1), 1)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_and_functions_are_recorded(self):
+        requests = self.sample('api_requests_total', view='view-loans', method='GET', status='200')
+        queries = self.sample('api_request_db_queries_sum', view='view-loans')
+        emis = self.sample('api_function_duration_seconds_count', function='calculate_emi')
+        checks = self.sample('api_function_duration_seconds_count', function='check_loan_eligibility')
+
+        self.client.get('/api/view-loans/1/')
+        self.client.post('/api/check-eligibility/', {'customer_id': 1, 'loan_amount': 1000, 'interest_rate': 14, 'tenure': 12},
+                         content_type='application/json')
+
+        self.assertEqual(self.sample('api_requests_total', view='view-loans', method='GET', status='200'), requests + 1)
+        self.assertEqual(self.sample('api_request_db_queries_sum', view='view-loans'), queries + 1)
+        self.assertEqual(self.sample('api_function_duration_seconds_count', function='calculate_emi'), emis + 1)
+        self.assertEqual(self.sample('api_function_duration_seconds_count', function='check_loan_eligibility'), checks + 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/no-such-page/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('api_requests_total{method="GET",status="404",view="unmatched"}', body)
+        self.assertIn('api_function_duration_seconds_bucket{function="calculate_credit_score"', body)
+        self.assertIn('api_score_cache_requests_total', body)
+
+
+def write_table(path, header, rows):
+    # an ingestion file in the format its suffix names
+    if path.endswith('.xlsx'):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(header)
+        for row in rows:
+            workbook.active.append(row)
+        workbook.save(path)
+    elif path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.Table.from_pylist([dict(zip(header, row)) for row in rows]), path)
+    else:
+        with open(path, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(header)
+            writer.writerows(rows)
+    return path
+
+
+CUSTOMER_HEADER = ['Customer ID', 'First Name', 'Last Name', 'Age', 'Phone Number', 'Monthly Salary', 'Approved Limit']
+
+
+class IngestionTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def file(self, name, header, rows):
+        return write_table(os.path.join(self.dir, name), header, rows)
+
+
+class CustomerIngestionTests(IngestionTestCase):
+    def test_second_run_updates_in_place(self):
+        rows = [[customer_id, 'A', 'B', 30, 9000000000 + customer_id, 50000, 1800000] for customer_id in range(1, 8)]
+        path = self.file('customers.xlsx', CUSTOMER_HEADER, rows)
+        self.assertEqual(load_customers(path, batch_size=3), "Customer data ingested: 7 created, 0 updated")
+        self.assertEqual(Customer.objects.get(pk=4).first_name, 'A')
+
+        rows[3][1] = 'Changed'
+        rows.append([8, 'New', 'C', 40, 9000000008, 60000, 2200000])
+        path = self.file('customers.xlsx', CUSTOMER_HEADER, rows)
+        self.assertEqual(load_customers(path, batch_size=3), "Customer data ingested: 1 created, 7 updated")
+        self.assertEqual(Customer.objects.count(), 8)
+        self.assertEqual(Customer.objects.get(pk=4).first_name, 'Changed')
+        self.assertEqual(Customer.objects.get(pk=8).approved_limit, 2200000)
+
+
+class ReaderTests(IngestionTestCase):
+    def test_every_format_streams_bounded_batches(self):
+        rows = [[customer_id, 'A', 'B', 30, 9000000000, 50000, 1800000] for customer_id in range(1, 24)]
+        for name in ('customers.xlsx', 'customers.csv', 'customers.parquet'):
+            with self.subTest(format=name):
+                path = self.file(name, CUSTOMER_HEADER, rows)
+                batches = list(iter_batches(path, 5))
+                self.assertTrue(all(len(batch) <= 5 for batch in batches))
+                # offsets run on from batch to batch
+                self.assertEqual([i for batch in batches for i in batch.index], list(range(23)))
+                self.assertEqual(
+                    [int(v) for batch in batches for v in batch['Customer ID']], list(range(1, 24)))
+                self.assertEqual(count_rows(path), 23)
+
+
+class IncrementalIngestionTests(IngestionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = [[customer_id, 'A', 'B', 30, 9000000000, 50000, 1800000] for customer_id in range(1, 13)]
+        # customer 2 twice in one batch: the last row wins and it counts once
+        self.rows.insert(2, list(self.rows[1]))
+        self.path = self.file('customers.csv', CUSTOMER_HEADER, self.rows)
+
+    def load(self):
+        return load_customers(self.path, batch_size=5, incremental=True)
+
+    def load_failing_at_batch(self, failing):
+        # load, raising in the given batch (1-based); returns the row offsets each batch started at
+        starts = []
+        upsert = tasks._upsert_customer_batch
+
+        def flaky(df, *args, **kwargs):
+            starts.append(int(df.index[0]))
+            if len(starts) == failing:
+                raise RuntimeError("worker lost")
+            return upsert(df, *args, **kwargs)
+
+        with mock.patch.object(tasks, '_upsert_customer_batch', flaky):
+            try:
+                result = self.load()
+            except RuntimeError:
+                result = None
+        return starts, result
+
+    def test_resumes_from_the_checkpoint(self):
+        starts, result = self.load_failing_at_batch(2)
+        self.assertIsNone(result)
+        self.assertEqual(IngestionCheckpoint.objects.get().rows_committed, 5)
+        self.assertEqual(Customer.objects.count(), 4)
+
+        starts, result = self.load_failing_at_batch(0)
+        self.assertEqual(starts, [5, 10])
+        self.assertEqual(result, "Customer data ingested: 8 created, 0 updated, 0 unchanged")
+        self.assertEqual(Customer.objects.count(), 12)
+
+    def test_changed_file_starts_over(self):
+        self.load_failing_at_batch(2)
+        self.rows[0][1] = 'Changed'
+        self.file('customers.csv', CUSTOMER_HEADER, self.rows + [[13, 'C', 'D', 30, 9000000000, 50000, 1800000]])
+        starts, result = self.load_failing_at_batch(0)
+        self.assertEqual(starts, [0, 5, 10])
+        self.assertEqual(result, "Customer data ingested: 9 created, 1 updated, 3 unchanged")
+
+    def test_unchanged_rows_are_skipped(self):
+        self.assertEqual(self.load(), "Customer data ingested: 12 created, 0 updated, 0 unchanged")
+        self.assertEqual(self.load(), "Customer data ingested: 0 created, 0 updated, 12 unchanged")
+
+        self.rows[5][5] = 80000
+        self.file('customers.csv', CUSTOMER_HEADER, self.rows)
+        self.assertEqual(self.load(), "Customer data ingested: 0 created, 1 updated, 11 unchanged")
+        self.assertEqual(Customer.objects.get(pk=5).monthly_salary, 80000)
+
+    def test_only_changed_customers_lose_their_cached_scores(self):
+        self.load()
+        for customer_id in (1, 5):
+            CustomerRiskContext.load(customer_id)
+        self.rows[5][5] = 80000
+        self.file('customers.csv', CUSTOMER_HEADER, self.rows)
+        self.load()
+        self.assertIsNotNone(score_cache.get(1))
+        self.assertIsNone(score_cache.get(5))
+
+    def test_cached_scores_are_dropped_again_on_commit(self):
+        self.load()
+        self.rows[5][5] = 80000
+        self.file('customers.csv', CUSTOMER_HEADER, self.rows)
+        refresh = exposure.refresh
+
+        def refill(*args, **kwargs):
+            # a reader caching customer 5 between the upsert and the commit
+            CustomerRiskContext.load(5)
+            return refresh(*args, **kwargs)
+
+        with mock.patch.object(exposure, 'refresh', refill), self.captureOnCommitCallbacks(execute=True):
+            self.load()
+        self.assertIsNone(score_cache.get(5))
+
+    def test_checkpoint_is_deleted_after_a_full_load(self):
+        self.load()
+        self.assertFalse(IngestionCheckpoint.objects.exists())
+
+
+LOAN_HEADER = ['Customer ID', 'Loan ID', 'Loan Amount', 'Tenure', 'Interest Rate', 'Monthly payment',
+               'EMIs paid on Time', 'Date of Approval', 'End Date']
+
+
+class LoanIngestionTests(IngestionTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = make_customer(1)
+        make_customer(2)
+        make_loan(customer, 100, emis_paid_on_time=3)
+
+    def loan_row(self, customer_id, loan_id, emis_paid_on_time=12):
+        return [customer_id, loan_id, 100000, 12, 10, 8792, emis_paid_on_time, '2020-01-01', '2021-01-01']
+
+    def test_unknown_customers_are_skipped_and_existing_loans_updated(self):
+        rows = [self.loan_row(1, 100), self.loan_row(2, 101), self.loan_row(3, 102), self.loan_row(99, 103)]
+        path = self.file('loans.csv', LOAN_HEADER, rows)
+        self.assertEqual(load_loans(path, batch_size=2), "Loan data ingested: 1 created, 1 updated, 2 skipped")
+
+        self.assertEqual(sorted(Loan.objects.values_list('loan_id', flat=True)), [100, 101])
+        updated = Loan.objects.get(loan_id=100)
+        self.assertEqual((updated.customer_id, updated.emis_paid_on_time), (1, 12))
+        self.assertEqual(Loan.objects.get(loan_id=101).customer_id, 2)
+        # the exposure rows follow the bulk upsert
+        self.assertEqual(CustomerExposure.objects.get(pk=2).loan_count, 1)
+
+    def test_exposure_is_refreshed_for_changed_loans_only(self):
+        rows = [self.loan_row(1, 100), self.loan_row(2, 101)]
+        path = self.file('loans.csv', LOAN_HEADER, rows)
+        load_loans(path, incremental=True)
+        with mock.patch.object(exposure, 'refresh', wraps=exposure.refresh) as refresh:
+            load_loans(path, incremental=True)
+        self.assertEqual([call.args[0] for call in refresh.call_args_list], [[]])
+
+        # loan 101 moves from customer 2 to customer 1: both rows change
+        rows[1][0] = 1
+        load_loans(self.file('loans.csv', LOAN_HEADER, rows), incremental=True)
+        self.assertEqual(CustomerExposure.objects.get(pk=1).loan_count, 2)
+        self.assertEqual(CustomerExposure.objects.get(pk=2).loan_count, 0)
+
+
+def task_state(state, info):
+    # patch the Celery result lookup of /ingestion-status/ (no result backend in tests)
+    result = SimpleNamespace(state=state, info=info, result=info)
+    return mock.patch.object(celery_app, 'AsyncResult', return_value=result)
+
+
+class IngestionProgressTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'customers.csv')
+        with open(self.path, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(['Customer ID', 'First Name', 'Last Name', 'Phone Number', 'Monthly Salary', 'Approved Limit'])
+            for customer_id in range(1, 26):
+                writer.writerow([customer_id, 'A', 'B', 9000000000, 50000, 1800000])
+            writer.writerow(['', 'No', 'Id', 1, 1, 1])
+
+    def test_progress_after_every_batch(self):
+        states = []
+        load_customers(self.path, batch_size=10, on_progress=states.append)
+        self.assertEqual([state['rows_read'] for state in states], [10, 20, 26])
+        self.assertEqual({state['rows_total'] for state in states}, {26})
+        last = states[-1]
+        self.assertEqual((last['rows_written'], last['rows_skipped'], last['eta_seconds']), (25, 1, 0))
+        self.assertGreater(last['rows_per_second'], 0)
+        self.assertIn('26/26 rows read (100.0%), 25 written', format_progress(last))
+
+    def test_task_publishes_progress_state(self):
+        with mock.patch.object(ingest_customer_data, 'update_state') as update_state:
+            ingest_customer_data.apply(args=[self.path], kwargs={'batch_size': 10}, task_id='ingest-1')
+        self.assertEqual(update_state.call_count, 3)
+        self.assertEqual(update_state.call_args.kwargs['state'], 'PROGRESS')
+        self.assertEqual(update_state.call_args.kwargs['meta']['rows_read'], 26)
+
+    def test_status_endpoint(self):
+        progress = {'stage': 'customers', 'rows_read': 10}
+        with task_state('PROGRESS', progress):
+            body = self.client.get('/api/ingestion-status/ingest-1/').json()
+        self.assertEqual(body, {'task_id': 'ingest-1', 'state': 'PROGRESS', 'progress': progress})
+        with task_state('SUCCESS', 'Customer data ingested: 25 created, 0 updated'):
+            body = self.client.get('/api/ingestion-status/ingest-1/').json()
+        self.assertEqual(body['result'], 'Customer data ingested: 25 created, 0 updated')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(SimpleTestCase):
+    # Routing decisions only: the test databases have no replica alias
+    router = ReplicaRouter()
+
+    def test_reads_go_to_replicas_and_writes_to_primary(self):
+        self.assertEqual(self.router.db_for_read(Loan), 'replica1')
+        self.assertEqual(self.router.db_for_write(Loan), 'default')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Loan), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'api'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'api'))
+
+    def test_primary_block(self):
+        with routers.primary():
+            self.assertEqual(self.router.db_for_read(Customer), 'default')
+        self.assertEqual(self.router.db_for_read(Customer), 'replica1')
+
+    def test_reads_stick_to_primary_after_a_write_in_the_request(self):
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Loan))
+            if request.method == 'POST':
+                self.router.db_for_write(Loan)
+            seen.append(self.router.db_for_read(Loan))
+            return HttpResponse()
+
+        middleware = PrimaryPinMiddleware(view)
+        middleware(RequestFactory().post('/'))
+        middleware(RequestFactory().get('/'))
+        self.assertEqual(seen, ['replica1', 'default', 'replica1', 'replica1'])
+        # and nothing leaks out of the request
+        self.assertEqual(self.router.db_for_read(Loan), 'replica1')
+
+
+class QueryBudgetTests(QueryBudgetMixin, ApiTestCase):
+    # Maximum queries per request for every view in api/urls.py. A new view
+    # needs an entry here; raising a number needs a reason.
+    BUDGETS = {
+        'register': 2, # + the customer's empty CustomerExposure row
+        'check-eligibility': 1,
+        'check-eligibility-batch': 1,
+        'create-loan': 8, # + the CustomerExposure update
+        'view-loan': 1,
+        'view-loans': 1,
+        'amortization': 1,
+        'export-loans': 3, # + the session and user lookups of the staff check
+        'ingestion-status': 0,
+        'simulate-policy': 3, # + the session and user lookups of the staff check
+        'async-check-eligibility': 1,
+        'async-view-loan': 1,
+        'async-view-loans': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = make_customer(1, monthly_salary=100000)
+        cls.loans = [make_loan(customer, loan_id) for loan_id in range(1, 11)]
+
+    def setUp(self):
+        super().setUp()
+        self.admin_client = Client()
+        self.admin_client.force_login(User.objects.create_user('admin', is_staff=True))
+
+    def requests(self):
+        application = {'customer_id': 1, 'loan_amount': 100000, 'interest_rate': 14, 'tenure': 12}
+        registration = {'first_name': 'A', 'last_name': 'B', 'age': 30, 'monthly_income': 50000, 'phone_number': 1}
+        loan_id = self.loans[0].id
+        return {
+            'register': lambda: self.client.post('/api/register/', registration, content_type='application/json'),
+            'check-eligibility': lambda: self.client.post('/api/check-eligibility/', application, content_type='application/json'),
+            'check-eligibility-batch': lambda: self.client.post('/api/check-eligibility/batch/', [application] * 50, content_type='application/json'),
+            'create-loan': lambda: self.client.post('/api/create-loan/', application, content_type='application/json'),
+            'view-loan': lambda: self.client.get(f'/api/view-loan/{loan_id}/'),
+            'view-loans': lambda: self.client.get('/api/view-loans/1/'),
+            'amortization': lambda: self.client.get(f'/api/amortization/{loan_id}/'),
+            'export-loans': lambda: self.consumed(self.admin_client.get('/api/export/loans.csv')),
+            'ingestion-status': self.ingestion_status,
+            'simulate-policy': self.simulate_policy,
+            'async-check-eligibility': lambda: self.client.post('/api/async/check-eligibility/', application, content_type='application/json'),
+            'async-view-loan': lambda: self.client.get(f'/api/async/view-loan/{loan_id}/'),
+            'async-view-loans': lambda: self.client.get('/api/async/view-loans/1/'),
+        }
+
+    def ingestion_status(self):
+        with task_state('SUCCESS', 'done'):
+            return self.client.get('/api/ingestion-status/abc/')
+
+    def simulate_policy(self):
+        payload = {'loan_amount': 100000, 'interest_rate': 14, 'tenure': 12, 'policy': {'min_score': 20}}
+        return self.admin_client.post('/api/simulate-policy/', payload, content_type='application/json')
+
+    def consumed(self, response):
+        # streamed responses query while their content is read
+        b''.join(response.streaming_content)
+        return response
+
+    def test_every_endpoint_has_a_budget(self):
+        names = {pattern.name for pattern in api_urls.urlpatterns}
+        self.assertEqual(names, set(self.BUDGETS))
+        self.assertEqual(names, set(self.requests()))
+
+    def test_endpoints_stay_within_budget(self):
+        for name, send in self.requests().items():
+            with self.subTest(endpoint=name):
+                # steady state: ID blocks reserved, score cache cold
+                send()
+                for cache in caches.all():
+                    cache.clear()
+                with self.assertQueryBudget(self.BUDGETS[name]):
+                    response = send()
+                self.assertLess(response.status_code, 300)
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers_and_report(self):
+        report.reset()
+        response = self.client.get('/api/view-loans/1/')
+        self.assertEqual(response['X-DB-Queries'], '1')
+        for header in ('X-DB-Time-ms', 'X-Serialization-Time-ms', 'X-Total-Time-ms'):
+            self.assertGreaterEqual(float(response[header]), 0)
+        summary = endpoint_report()['view-loans']
+        self.assertEqual(summary['requests'], 1)
+        self.assertEqual(summary['max_queries'], 1)
+
+
+class LoanIndexTests(ApiTestCase):
+    # The planner must pick the access-path indexes on a table big enough
+    # that a scan would cost more than the index lookup.
+
+    @classmethod
+    def setUpTestData(cls):
+        Customer.objects.bulk_create([
+            Customer(customer_id=i, first_name='T', last_name='C', phone_number=i, monthly_salary=50000, approved_limit=10 ** 6)
+            for i in range(1, 501)
+        ])
+        Loan.objects.bulk_create([
+            Loan(customer_id=i % 500 + 1, loan_id=i, loan_amount=10000, tenure=12, interest_rate=10,
+                 monthly_repayment=1000, emis_paid_on_time=6,
+                 start_date=date(2010 + i % 17, 1 + i % 12, 1), end_date=date(2011 + i % 30, 1 + i % 12, 1))
+            for i in range(1, 20001)
+        ], batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_active_emi_sum_uses_end_date_index(self):
+        today = datetime.now().date()
+        self.assertUsesIndex(
+            Loan.objects.filter(customer_id=42, end_date__gte=today).values('monthly_repayment'),
+            'loan_customer_end_date_idx',
+        )
+
+    def test_current_year_count_uses_start_date_index(self):
+        self.assertUsesIndex(
+            Loan.objects.filter(customer_id=42, **current_year_range('start_date')).values('id'),
+            'loan_customer_start_date_idx',
+        )
+
+    def test_year_range_matches_year_lookup(self):
+        year = datetime.now().year
+        self.assertEqual(
+            Loan.objects.filter(**current_year_range('start_date')).count(),
+            Loan.objects.filter(start_date__year=year).count(),
+        )
+
+
+class FastPathSerializerTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = make_customer(1)
+        customer.age = 40
+        customer.save()
+        cls.loans = [
+            make_loan(customer, loan_id, loan_amount=12345 + loan_id, monthly_repayment=Decimal('1034.55'),
+                      emis_paid_on_time=loan_id)
+            for loan_id in range(1, 6)
+        ]
+
+    def render(self, renderer, data):
+        return json.loads(renderer.render(data))
+
+    def test_view_loans_matches_model_serializer(self):
+        loans = Loan.objects.filter(customer_id=1).order_by('id')
+        expected = self.render(JSONRenderer(), CustomerLoanSerializer(loans, many=True).data)
+        fast = self.render(ORJSONRenderer(), list(customer_loan_rows(customer_loan_values(loans))))
+        self.assertEqual(fast, expected)
+        self.assertEqual(self.client.get('/api/view-loans/1/').json()['results'], expected)
+
+    def test_view_loan_matches_model_serializer(self):
+        loan = self.loans[2]
+        expected = self.render(JSONRenderer(), ViewLoanSerializer(loan).data)
+        self.assertEqual(self.render(ORJSONRenderer(), view_loan_row(Loan.objects.all(), loan.id)), expected)
+        self.assertEqual(self.client.get(f'/api/view-loan/{loan.id}/').json(), expected)
+        self.assertEqual(self.client.get('/api/view-loan/999/').status_code, 404)
+
+    def test_renderer_handles_decimal_and_numpy(self):
+        body = ORJSONRenderer().render({'a': Decimal('1.50'), 'b': np.int64(3), 'c': np.array([1.5])})
+        self.assertEqual(json.loads(body), {'a': '1.50', 'b': 3, 'c': [1.5]})
+
+    def test_renderer_writes_datetimes_like_drf(self):
+        data = {'at': timezone.make_aware(datetime(2024, 5, 1, 12, 30, 15, 250000)), 'on': date(2024, 5, 1)}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(json.loads(dumps(data))['at'], '2024-05-01T12:30:15.250000Z')
+
+    def test_renderer_rejects_out_of_range_floats_like_drf(self):
+        for value in (float('nan'), float('inf'), -float('inf'), np.float32('nan'), np.array([1.0, np.inf])):
+            data = {'rows': [{'score': value, 'loan_id': None}]}
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render(data)
+                with self.assertRaises(ValueError):
+                    ORJSONRenderer().render(data)
+                with self.assertRaises(ValueError):
+                    dumps(data)
+        self.assertEqual(json.loads(ORJSONRenderer().render({'score': 1.5, 'loan_id': None})),
+                         {'score': 1.5, 'loan_id': None})
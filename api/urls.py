@@ -1,16 +1,32 @@
 from django.urls import path
+from . import async_views
 from .views import (
     RegisterView,
     CheckEligibilityView,
+    CheckEligibilityBatchView,
     CreateLoanView,
     ViewLoanView,
-    ViewCustomerLoansView
+    ViewCustomerLoansView,
+    AmortizationView,
+    ExportLoansView,
+    IngestionStatusView,
+    PolicySimulationView,
 )
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('check-eligibility/', CheckEligibilityView.as_view(), name='check-eligibility'),
+    path('check-eligibility/batch/', CheckEligibilityBatchView.as_view(), name='check-eligibility-batch'),
     path('create-loan/', CreateLoanView.as_view(), name='create-loan'),
     path('view-loan/<int:id>/', ViewLoanView.as_view(), name='view-loan'),
     path('view-loans/<int:customer_id>/', ViewCustomerLoansView.as_view(), name='view-loans'),
+    path('amortization/<int:id>/', AmortizationView.as_view(), name='amortization'),
+    path('export/loans.<str:extension>', ExportLoansView.as_view(), name='export-loans'),
+    path('ingestion-status/<str:task_id>/', IngestionStatusView.as_view(), name='ingestion-status'),
+    path('simulate-policy/', PolicySimulationView.as_view(), name='simulate-policy'),
+
+    # Async versions for ASGI servers (see async_views.py)
+    path('async/check-eligibility/', async_views.check_eligibility, name='async-check-eligibility'),
+    path('async/view-loan/<int:id>/', async_views.view_loan, name='async-view-loan'),
+    path('async/view-loans/<int:customer_id>/', async_views.view_customer_loans, name='async-view-loans'),
 ]
\ No newline at end of file
@@ -1,53 +1,133 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
+from rest_framework.permissions import IsAdminUser
 from .models import Customer, Loan
-from .serializers import ViewLoanSerializer, CustomerLoanSerializer
+from .serializers import (
+    ViewLoanSerializer,
+    CustomerLoanSerializer,
+    customer_loan_rows,
+    customer_loan_values,
+    view_loan_row,
+)
+from .renderers import dumps
+from .eligibility import evaluate_applications, score_input_annotations
+from .policy import DEFAULT_POLICY, EligibilityPolicy
+from . import amortization, export, exposure, idempotency, metrics, score_cache, simulation
+from .ids import customer_ids, loan_ids
+from .pagination import LoanCursorPagination
 import math
 from datetime import datetime
-from django.db.models import Sum
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
+from django.db.models import F
 from decimal import Decimal
 import pandas as pd
+from credit_system import celery_app
 
 # --- Helper Functions ---
 
-def calculate_credit_score(customer_id):
+def credit_score_inputs(customer_id):
+    # The customer row with every loan aggregate the score and the EMI check
+    # need, read from its CustomerExposure row in one query. Without a current
+    # row they are aggregated from Loan instead, in a single GROUP BY query.
+    # Returns None for unknown customers.
+    today = datetime.now().date()
+    customer = Customer.objects.select_related('exposure').filter(customer_id=customer_id).first()
+    if customer is None or exposure.apply(customer, today):
+        return customer
+    return Customer.objects.filter(customer_id=customer_id).annotate(
+        **score_input_annotations(today)
+    ).first()
+
+async def acredit_score_inputs(customer_id):
+    # credit_score_inputs for async views
+    today = datetime.now().date()
+    customer = await Customer.objects.select_related('exposure').filter(customer_id=customer_id).afirst()
+    if customer is None or exposure.apply(customer, today):
+        return customer
+    return await Customer.objects.filter(customer_id=customer_id).annotate(
+        **score_input_annotations(today)
+    ).afirst()
+
+def score_from_inputs(current_debt, approved_limit, total_emis, total_paid_on_time, loan_count, current_year_loans):
     # This is the most complex part[cite: 48]. You must define your own logic.
     # Here is a *sample* logic.
     score = 100
-    try:
-        customer = Customer.objects.get(customer_id=customer_id)
-        loans = Loan.objects.filter(customer=customer)
-
-        # Component v: current_debt > approved_limit [cite: 57]
-        if customer.current_debt > customer.approved_limit:
-            return 0
-
-        # Component i: Past Loans paid on time [cite: 50]
-        total_emis = sum(loan.tenure for loan in loans)
-        total_paid_on_time = sum(loan.emis_paid_on_time for loan in loans)
-        if total_emis > 0:
-            payment_ratio = total_paid_on_time / total_emis
-            if payment_ratio < 0.8: score -= 30
-            elif payment_ratio < 0.9: score -= 15
-        
-        # Component ii: No of loans taken in past [cite: 51]
-        if loans.count() > 5:
-            score -= 20
 
-        # Component iii: Loan activity in current year [cite: 53]
-        current_year_loans = loans.filter(start_date__year=datetime.now().year).count()
-        if current_year_loans > 3:
-            score -= 25
+    # Component v: current_debt > approved_limit [cite: 57]
+    if current_debt > approved_limit:
+        return 0
 
-        # Component iv: Loan approved volume [cite: 55]
-        # (This is vague, let's skip for this simple model)
-        
-        return max(score, 0) # Ensure score is not negative
+    # Component i: Past Loans paid on time [cite: 50]
+    if total_emis > 0:
+        payment_ratio = total_paid_on_time / total_emis
+        if payment_ratio < 0.8: score -= 30
+        elif payment_ratio < 0.9: score -= 15
+
+    # Component ii: No of loans taken in past [cite: 51]
+    if loan_count > 5:
+        score -= 20
 
-    except Customer.DoesNotExist:
+    # Component iii: Loan activity in current year [cite: 53]
+    if current_year_loans > 3:
+        score -= 25
+
+    # Component iv: Loan approved volume [cite: 55]
+    # (This is vague, let's skip for this simple model)
+
+    return max(score, 0) # Ensure score is not negative
+
+class CustomerRiskContext:
+    """
+    Everything one eligibility decision needs about a customer, loaded once
+    per request: the customer row, its credit score inputs and the EMI total
+    of the loans still running.
+    """
+    def __init__(self, customer):
+        self.customer = customer
+        self.credit_score = score_from_inputs(
+            customer.current_debt,
+            customer.approved_limit,
+            customer.total_emis,
+            customer.total_paid_on_time,
+            customer.loan_count,
+            customer.current_year_loans,
+        )
+        self.current_emis_sum = customer.current_emis_sum
+
+    @classmethod
+    def load(cls, customer_id, use_cache=True):
+        # Served from the credit score cache when possible (see score_cache.py)
+        customer = score_cache.get(customer_id) if use_cache else None
+        if customer is None:
+            customer = credit_score_inputs(customer_id)
+            if customer is None:
+                return None
+            score_cache.store(customer)
+        return cls(customer)
+
+    @classmethod
+    async def aload(cls, customer_id, use_cache=True):
+        # load() for async views: the same cache, read with the async ORM
+        customer = await score_cache.aget(customer_id) if use_cache else None
+        if customer is None:
+            customer = await acredit_score_inputs(customer_id)
+            if customer is None:
+                return None
+            await score_cache.astore(customer)
+        return cls(customer)
+
+@metrics.timed('calculate_credit_score')
+def calculate_credit_score(customer_id, context=None):
+    if context is None:
+        context = CustomerRiskContext.load(customer_id)
+    if context is None:
         return 0 # No customer, no score
+    return context.credit_score
 
+@metrics.timed('calculate_emi')
 def calculate_emi(principal, annual_rate, tenure_months):
     # Standard EMI formula based on P, r, n
     # The prompt mentions "compound interest"[cite: 38], but this EMI formula
@@ -62,40 +142,44 @@ def calculate_emi(principal, annual_rate, tenure_months):
     emi = principal * r * (pow(1 + r, n)) / (pow(1 + r, n) - 1)
     return round(emi, 2)
 
-def check_loan_eligibility(customer_id, loan_amount, interest_rate, tenure):
-    try:
-        customer = Customer.objects.get(customer_id=customer_id)
-    except Customer.DoesNotExist:
+@metrics.timed('check_loan_eligibility')
+def check_loan_eligibility(customer_id, loan_amount, interest_rate, tenure, context=None, policy=None):
+    # context: a CustomerRiskContext the caller already loaded for this request
+    # policy: the EligibilityPolicy thresholds, DEFAULT_POLICY unless given
+    policy = policy or DEFAULT_POLICY
+    if context is None:
+        context = CustomerRiskContext.load(customer_id)
+    if context is None:
         return {'approval': False, 'message': 'Customer not found'}
+    customer = context.customer
 
-    credit_score = calculate_credit_score(customer_id)
+    credit_score = calculate_credit_score(customer_id, context)
     
     approval = False
     corrected_interest_rate = interest_rate
     
     # 1. Credit Score Check [cite: 58-63]
-    if credit_score > 50:
+    if credit_score > policy.prime_score:
         approval = True # [cite: 59]
-    elif 30 < credit_score <= 50:
-        if interest_rate > 12: approval = True # [cite: 60]
+    elif policy.medium_score < credit_score <= policy.prime_score:
+        if interest_rate > policy.medium_rate: approval = True # [cite: 60]
         else:
             approval = True
-            corrected_interest_rate = 12.0 # Corrected rate [cite: 65-67]
-    elif 10 < credit_score <= 30:
-        if interest_rate > 16: approval = True # [cite: 62]
+            corrected_interest_rate = policy.medium_rate # Corrected rate [cite: 65-67]
+    elif policy.min_score < credit_score <= policy.medium_score:
+        if interest_rate > policy.low_rate: approval = True # [cite: 62]
         else:
             approval = True
-            corrected_interest_rate = 16.0
-    else: # 10 >= credit_score
+            corrected_interest_rate = policy.low_rate
+    else: # policy.min_score >= credit_score
         approval = False # [cite: 63]
         return {'approval': False, 'message': 'Credit score too low'}
 
     # 2. EMI Check [cite: 64]
     new_emi = calculate_emi(loan_amount, corrected_interest_rate, tenure)
     
-    # Find sum of EMIs for *current* loans (loans not yet ended)
-    current_loans = Loan.objects.filter(customer=customer, end_date__gte=datetime.now().date())
-    current_emis_sum = current_loans.aggregate(Sum('monthly_repayment'))['monthly_repayment__sum'] or 0
+    # Sum of EMIs for *current* loans (loans not yet ended), loaded with the context
+    current_emis_sum = context.current_emis_sum
 
 #    if (current_emis_sum + Decimal(str(new_emi))) > (Decimal(customer.monthly_salary) * Decimal('0.5')):
 #        approval = False # [cite: 64]
@@ -109,9 +193,9 @@ def check_loan_eligibility(customer_id, loan_amount, interest_rate, tenure):
 #         'tenure': tenure,
 #         'monthly_installment': new_emi
 #     }
-    if (current_emis_sum + Decimal(str(new_emi))) > (Decimal(customer.monthly_salary) * Decimal('0.5')):
+    if (current_emis_sum + Decimal(str(new_emi))) > (Decimal(customer.monthly_salary) * Decimal(str(policy.max_emi_share))):
         approval = False
-        return {'approval': False, 'message': 'Total EMI exceeds 50% of monthly salary'}
+        return {'approval': False, 'message': f'Total EMI exceeds {policy.max_emi_share:.0%} of monthly salary'}
 
     return {
         'approval': approval,
@@ -130,6 +214,7 @@ class RegisterView(APIView):
     """
     API for /register [cite: 38]
     """
+    @idempotency.idempotent('register')
     def post(self, request):
         data = request.data
         monthly_income = data.get('monthly_income')
@@ -139,9 +224,8 @@ class RegisterView(APIView):
 
         try:
             # Create a new customer. Note: We need a new unique customer_id.
-            # We'll just auto-increment from the last one.
-            last_customer = Customer.objects.order_by('-customer_id').first()
-            new_customer_id = (last_customer.customer_id + 1) if last_customer else 1
+            # It comes from this process's reserved block (see ids.py).
+            new_customer_id = customer_ids.next_id()
 
             customer = Customer.objects.create(
                 customer_id=new_customer_id,
@@ -167,43 +251,65 @@ class RegisterView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+# Identical checks in flight at the same time share one computation
+eligibility_checks = idempotency.SingleFlight()
+
 class CheckEligibilityView(APIView):
     """
     API for /check-eligibility [cite: 47]
     """
     def post(self, request):
         data = request.data
-        result = check_loan_eligibility(
-            data.get('customer_id'),
-            data.get('loan_amount'),
-            data.get('interest_rate'),
-            data.get('tenure')
+        application = (data.get('customer_id'), data.get('loan_amount'), data.get('interest_rate'), data.get('tenure'))
+        result, _ = eligibility_checks.do(
+            idempotency.fingerprint(application),
+            lambda: check_loan_eligibility(*application)
         )
-        
-        # Build response body [cite: 71]
-        response_data = {
-            "customer_id": result.get('customer_id'),
-            "approval": result.get('approval'),
-            "interest_rate": result.get('interest_rate'),
-            "corrected_interest_rate": result.get('corrected_interest_rate') or result.get('interest_rate'),
-            "tenure": result.get('tenure'),
-            "monthly_installment": result.get('monthly_installment')
-        }
-        return Response(response_data, status=status.HTTP_200_OK)
+        return Response(eligibility_response(result), status=status.HTTP_200_OK)
+
+def eligibility_response(result):
+    # Build response body [cite: 71]
+    return {
+        "customer_id": result.get('customer_id'),
+        "approval": result.get('approval'),
+        "interest_rate": result.get('interest_rate'),
+        "corrected_interest_rate": result.get('corrected_interest_rate') or result.get('interest_rate'),
+        "tenure": result.get('tenure'),
+        "monthly_installment": result.get('monthly_installment')
+    }
+
+class CheckEligibilityBatchView(APIView):
+    """
+    API for /check-eligibility/batch: the eligibility check for a list of
+    applications, evaluated together. Results come back in input order.
+    """
+    def post(self, request):
+        data = request.data
+        applications = data.get('applications') if isinstance(data, dict) else data
+        if not isinstance(applications, list) or not all(isinstance(a, dict) for a in applications):
+            return Response({"error": "Expected a list of applications"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"results": evaluate_applications(applications)}, status=status.HTTP_200_OK)
 
 class CreateLoanView(APIView):
     """
     API for /create-loan [cite: 72]
     """
+    @idempotency.idempotent('create-loan')
     def post(self, request):
         data = request.data
         customer_id = data.get('customer_id')
-        
+
+        # Load the customer and its loan aggregates once for the whole request
+        context = CustomerRiskContext.load(customer_id)
+        if context is None:
+            return Response(create_loan_response(customer_id, False, 'Customer not found'), status=status.HTTP_200_OK)
         eligibility_result = check_loan_eligibility(
             customer_id,
             data.get('loan_amount'),
             data.get('interest_rate'),
-            data.get('tenure')
+            data.get('tenure'),
+            context=context
         )
         
         loan_approved = eligibility_result.get('approval')
@@ -213,62 +319,210 @@ class CreateLoanView(APIView):
 
         if loan_approved:
             try:
-                customer = Customer.objects.get(customer_id=customer_id)
-                
-                # We need a new unique loan_id
-                last_loan = Loan.objects.order_by('-loan_id').first()
-                new_loan_id = (last_loan.loan_id + 1) if last_loan else 1
-                
-                new_loan = Loan.objects.create(
-                    customer=customer,
-                    loan_id=new_loan_id,
-                    loan_amount=data.get('loan_amount'),
-                    tenure=data.get('tenure'),
-                    interest_rate=eligibility_result.get('corrected_interest_rate'),
-                    monthly_repayment=eligibility_result.get('monthly_installment'),
-                    emis_paid_on_time=0,
-                    start_date=datetime.now().date(),
-                    # Assuming tenure is in months to calculate end_date
-                    end_date=datetime.now().date() + pd.DateOffset(months=data.get('tenure'))
-                )
-                
-                # IMPORTANT: Update customer's current_debt
-                customer.current_debt += data.get('loan_amount')
-                customer.save()
-                
-                loan_id = new_loan.id # Use the auto-created primary key
-                monthly_installment = new_loan.monthly_repayment
-                message = "Loan approved and created successfully"
-                
+                # We need a new unique loan_id, from this process's reserved
+                # block; taken before the transaction so a rollback cannot undo
+                # the reservation of a block this process goes on using
+                new_loan_id = loan_ids.next_id()
+                with transaction.atomic():
+                    # Lock the customer row: concurrent applications for the same
+                    # customer queue up here, so each one sees the loans and debt
+                    # committed by the others before it.
+                    list(Customer.objects.select_for_update().filter(customer_id=customer_id).values_list('pk', flat=True))
+
+                    # Re-run the check under the lock with fresh (uncached) aggregates
+                    eligibility_result = check_loan_eligibility(
+                        customer_id,
+                        data.get('loan_amount'),
+                        data.get('interest_rate'),
+                        data.get('tenure'),
+                        context=CustomerRiskContext.load(customer_id, use_cache=False)
+                    )
+                    loan_approved = eligibility_result.get('approval')
+                    message = eligibility_result.get('message', '')
+
+                    if loan_approved:
+                        new_loan = Loan.objects.create(
+                            customer_id=customer_id,
+                            loan_id=new_loan_id,
+                            loan_amount=data.get('loan_amount'),
+                            tenure=data.get('tenure'),
+                            interest_rate=eligibility_result.get('corrected_interest_rate'),
+                            monthly_repayment=eligibility_result.get('monthly_installment'),
+                            emis_paid_on_time=0,
+                            start_date=datetime.now().date(),
+                            # Assuming tenure is in months to calculate end_date
+                            end_date=datetime.now().date() + pd.DateOffset(months=data.get('tenure'))
+                        )
+
+                        # IMPORTANT: Update customer's current_debt, in the database
+                        # so a stale in-memory value can never overwrite it
+                        Customer.objects.filter(customer_id=customer_id).update(
+                            current_debt=F('current_debt') + Decimal(str(data.get('loan_amount')))
+                        )
+                        # update() sends no post_save
+                        score_cache.invalidate_on_commit(customer_id)
+
+                        loan_id = new_loan.id # Use the auto-created primary key
+                        monthly_installment = new_loan.monthly_repayment
+                        message = "Loan approved and created successfully"
+
             except Exception as e:
                 loan_approved = False
                 message = f"Error creating loan: {str(e)}"
-        
-        # Build response body [cite: 78]
-        response_data = {
-            "loan_id": loan_id,
-            "customer_id": customer_id,
-            "loan_approved": loan_approved,
-            "message": message,
-            "monthly_installment": monthly_installment
-        }
+
+        response_data = create_loan_response(customer_id, loan_approved, message, loan_id, monthly_installment)
         return Response(response_data, status=status.HTTP_201_CREATED if loan_approved else status.HTTP_200_OK)
 
+def create_loan_response(customer_id, loan_approved, message, loan_id=None, monthly_installment=None):
+    # Build response body [cite: 78]
+    return {
+        "loan_id": loan_id,
+        "customer_id": customer_id,
+        "loan_approved": loan_approved,
+        "message": message,
+        "monthly_installment": monthly_installment
+    }
+
 
 class ViewLoanView(generics.RetrieveAPIView):
     """
     API for /view-loan/<loan_id> [cite: 79]
     """
-    queryset = Loan.objects.all()
+    queryset = Loan.objects.select_related('customer') # customer is serialized too
     serializer_class = ViewLoanSerializer
     lookup_field = 'id' # We use the 'id' (PK) from the URL
 
+    def retrieve(self, request, *args, **kwargs):
+        # Fast path: ViewLoanSerializer's output built from one .values() row
+        row = view_loan_row(self.get_queryset(), self.kwargs['id'])
+        if row is None:
+            raise Http404
+        return Response(row)
+
 class ViewCustomerLoansView(generics.ListAPIView):
     """
     API for /view-loans/<customer_id> [cite: 83]
+    Paginated by cursor (see pagination.py); ?stream=1 returns every loan as
+    one streamed JSON list instead.
     """
     serializer_class = CustomerLoanSerializer
-    
+    pagination_class = LoanCursorPagination
+
     def get_queryset(self):
         customer_id = self.kwargs['customer_id']
-        return Loan.objects.filter(customer__customer_id=customer_id)
\ No newline at end of file
+        return Loan.objects.filter(customer__customer_id=customer_id).order_by('id')
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') in ('1', 'true'):
+            return StreamingHttpResponse(self.stream_rows(), content_type='application/json')
+        # Fast path: CustomerLoanSerializer's output built from .values() rows
+        page = self.paginate_queryset(customer_loan_values(self.get_queryset()))
+        return self.get_paginated_response(list(customer_loan_rows(page)))
+
+    def stream_rows(self):
+        # Rows are read from the database chunk by chunk (a server-side cursor
+        # on PostgreSQL) and written out as they come, so memory stays flat
+        chunk_size = getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+        rows = customer_loan_values(self.get_queryset()).iterator(chunk_size=chunk_size)
+        yield '['
+        for i, row in enumerate(customer_loan_rows(rows)):
+            yield (',' if i else '') + dumps(row)
+        yield ']'
+
+class AmortizationView(APIView):
+    """
+    API for /amortization/<loan_id>: the repayment schedule of a loan
+    """
+    def get(self, request, id):
+        try:
+            loan = Loan.objects.get(id=id)
+        except Loan.DoesNotExist:
+            return Response({"error": "Loan not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        installment = amortization.emi(loan.loan_amount, loan.interest_rate, loan.tenure)
+        plan = amortization.schedule(loan.loan_amount, loan.interest_rate, loan.tenure)
+        outstanding = amortization.outstanding_balance(
+            loan.loan_amount, loan.interest_rate, loan.tenure, loan.emis_paid_on_time, installment
+        )
+
+        response_data = {
+            "loan_id": loan.id,
+            "loan_amount": loan.loan_amount,
+            "interest_rate": loan.interest_rate,
+            "tenure": loan.tenure,
+            "monthly_installment": round(float(installment), 2),
+            "repayments_left": loan.tenure - loan.emis_paid_on_time,
+            "outstanding_balance": round(float(outstanding), 2),
+            "schedule": [
+                {
+                    "period": period + 1,
+                    "payment": round(float(plan['payment'][0, period]), 2),
+                    "interest": round(float(plan['interest'][0, period]), 2),
+                    "principal": round(float(plan['principal'][0, period]), 2),
+                    "balance": round(float(plan['balance'][0, period]), 2),
+                }
+                for period in range(loan.tenure)
+            ],
+        }
+        return Response(response_data, status=status.HTTP_200_OK)
+
+class ExportLoansView(APIView):
+    """
+    API for /export/loans.<csv|parquet>: every loan joined with its customer,
+    streamed (see export.py). ?start= and ?end= (YYYY-MM-DD) bound the
+    approval date, ?active=true|false keeps running or ended loans only.
+    Staff only: the export holds every customer's name and phone number.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, extension):
+        if extension not in export.FORMATS:
+            return Response({"error": "Unknown export format"}, status=status.HTTP_404_NOT_FOUND)
+        params = request.query_params
+        try:
+            filters = export.parse_filters(params.get('start'), params.get('end'), params.get('active'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = export.export_rows(**filters)
+        response = StreamingHttpResponse(export.iter_export(extension, rows), content_type=export.FORMATS[extension])
+        response['Content-Disposition'] = f'attachment; filename="loans.{extension}"'
+        return response
+
+class IngestionStatusView(APIView):
+    """
+    API for /ingestion-status/<task_id>: state of an ingestion task, with its
+    progress while it runs (rows read/written/skipped, rows per second, ETA)
+    """
+    def get(self, request, task_id):
+        result = celery_app.AsyncResult(task_id)
+        state = result.state
+        response_data = {"task_id": task_id, "state": state}
+        if state == 'PROGRESS':
+            response_data["progress"] = result.info
+        elif state == 'SUCCESS':
+            response_data["result"] = result.result
+        elif state == 'FAILURE':
+            response_data["error"] = str(result.result)
+        return Response(response_data, status=status.HTTP_200_OK)
+
+class PolicySimulationView(APIView):
+    """
+    API for /simulate-policy (staff only): approval outcomes of every customer
+    for a hypothetical loan under the current policy and under the thresholds
+    in "policy" (see simulation.py). Body: loan_amount, interest_rate, tenure
+    and policy, e.g. {"max_emi_share": 0.6}; missing thresholds keep their
+    current values.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        data = request.data
+        if not isinstance(data, dict):
+            return Response({"error": "Expected an object"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            loan = simulation.parse_loan(data.get('loan_amount'), data.get('interest_rate'), data.get('tenure'))
+            policy = EligibilityPolicy.from_dict(data.get('policy') or {})
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(simulation.simulate(policy, **loan), status=status.HTTP_200_OK)
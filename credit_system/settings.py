@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
 from pathlib import Path
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,6 +33,78 @@ ALLOWED_HOSTS = []
 # CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_BROKER', 'redis://localhost:6379/0')
+CELERY_BEAT_SCHEDULE = {
+    # CustomerExposure rows go stale at midnight; rebuild them and repair drift
+    'reconcile-customer-exposure': {
+        'task': 'api.tasks.reconcile_customer_exposure',
+        'schedule': crontab(hour=0, minute=5),
+    },
+}
+
+# Rows per bulk upsert statement in the ingestion tasks
+INGESTION_BATCH_SIZE = int(os.environ.get('INGESTION_BATCH_SIZE', 5000))
+
+# /view-loans/ page size, and rows fetched per round trip when streaming
+LOANS_PAGE_SIZE = int(os.environ.get('LOANS_PAGE_SIZE', 100))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 2000))
+
+# IDs reserved at a time by each process for new customers and loans (api/ids.py)
+ID_BLOCK_SIZE = int(os.environ.get('ID_BLOCK_SIZE', 50))
+
+# Customers per shard of the portfolio rescoring job (api/rescoring.py)
+RESCORE_SHARD_SIZE = int(os.environ.get('RESCORE_SHARD_SIZE', 50000))
+
+# Caches
+# Local memory by default; set REDIS_CACHE_URL to share the cache between
+# processes in production. The credit score cache keeps a customer's score
+# inputs for CREDIT_SCORE_CACHE_TTL seconds, at most CREDIT_SCORE_CACHE_MAX_ENTRIES
+# of them (locmem only; size Redis with maxmemory + an LRU eviction policy).
+CREDIT_SCORE_CACHE = 'scores'
+CREDIT_SCORE_CACHE_TTL = int(os.environ.get('CREDIT_SCORE_CACHE_TTL', 300))
+CREDIT_SCORE_CACHE_MAX_ENTRIES = int(os.environ.get('CREDIT_SCORE_CACHE_MAX_ENTRIES', 100000))
+# Responses stored for Idempotency-Key retries of /register/ and /create-loan/
+# are kept IDEMPOTENCY_TTL seconds. Across several processes this needs Redis.
+IDEMPOTENCY_CACHE = 'idempotency'
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 100000))
+
+if os.environ.get('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+        },
+        'scores': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+            'TIMEOUT': CREDIT_SCORE_CACHE_TTL,
+            'KEY_PREFIX': 'scores',
+        },
+        'idempotency': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+            'TIMEOUT': IDEMPOTENCY_TTL,
+            'KEY_PREFIX': 'idempotency',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'scores': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'scores',
+            'TIMEOUT': CREDIT_SCORE_CACHE_TTL,
+            'OPTIONS': {'MAX_ENTRIES': CREDIT_SCORE_CACHE_MAX_ENTRIES},
+        },
+        'idempotency': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'idempotency',
+            'TIMEOUT': IDEMPOTENCY_TTL,
+            'OPTIONS': {'MAX_ENTRIES': IDEMPOTENCY_MAX_ENTRIES},
+        },
+    }
 
 
 # Application definition
@@ -55,8 +128,18 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.QueryBudgetMiddleware',
+    'api.routers.PrimaryPinMiddleware',
 ]
 
+REST_FRAMEWORK = {
+    # orjson-backed JSON (api/renderers.py); same output as DRF's JSONRenderer, faster
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 ROOT_URLCONF = 'credit_system.urls'
 
 TEMPLATES = [
@@ -102,10 +185,39 @@ DATABASES = {
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
-        'PORT': '5432',
+        'PORT': os.environ.get('DB_PORT', '5432'),
     }
 }
 
+# DB_ENGINE=sqlite runs against a local SQLite file instead (benchmarks, local runs)
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME') or BASE_DIR / 'db.sqlite3',
+        }
+    }
+    # SQLite ignores the included columns of covering indexes, which is fine locally
+    SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Read replicas: DB_REPLICAS is a comma separated list of replica hosts (same
+# database, user and password as the primary), or of database files with
+# DB_ENGINE=sqlite. api.routers.ReplicaRouter sends reads there (see routers.py).
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dict(DATABASES['default'])
+    DATABASES[alias]['NAME' if DATABASES[alias]['ENGINE'].endswith('sqlite3') else 'HOST'] = replica.strip()
+    # tests run against the primary only
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+# Seconds a replica may lag behind the primary. For that long after a write the
+# credit score cache keeps the inputs that replica reads produce out (score_cache.py).
+DATABASE_REPLICA_MAX_LAG = int(os.environ.get('DB_REPLICA_MAX_LAG', 10))
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
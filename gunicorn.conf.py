@@ -0,0 +1,8 @@
+# gunicorn settings picked up automatically from the working directory.
+# With PROMETHEUS_MULTIPROC_DIR set (an empty directory, cleared on every
+# start), /metrics adds up the values of all workers (api/metrics.py).
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)